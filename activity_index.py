@@ -0,0 +1,162 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from datetime import timedelta
+
+from storage import new_activity_id
+
+INDEXED_FIELDS = ('status', 'priority', 'responsible')
+
+# Högsta möjliga id i jämförelser, för inkluderande datumintervall
+_MAX_ID = '\U0010ffff'
+
+
+def _values(value):
+    return {value} if isinstance(value, str) else set(value)
+
+
+class ActivityRepository:
+    """Aktiviteterna med sekundärindex för snabb filtrering och sortering
+
+    Listan som skickas in ändras på plats, så iso_data['activities'] och
+    indexen hålls i takt så länge alla ändringar går via add/update/remove.
+    Index: mängder av id per status, prioritet och ansvarig samt en
+    datumsorterad lista av (due_date, id).
+
+    Med own läses listan bara, t.ex. en delad bas (se SessionPlan), tills
+    första ändringen; då anropas own() för att få en egen, muterbar kopia
+    och repositoryt fortsätter med den.
+    """
+
+    def __init__(self, activities, own=None):
+        self.activities = activities
+        self._own = own
+        self._by_id = {}
+        self._index = {field: defaultdict(set) for field in INDEXED_FIELDS}
+        self._due = []
+        for activity in activities:
+            activity.setdefault('id', new_activity_id())
+            self._index_add(activity, sort=False)
+        self._due.sort()
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def _index_add(self, activity, sort=True):
+        activity_id = activity['id']
+        self._by_id[activity_id] = activity
+        for field in INDEXED_FIELDS:
+            self._index[field][activity.get(field)].add(activity_id)
+        entry = (activity.get('due_date') or '', activity_id)
+        if sort:
+            insort(self._due, entry)
+        else:
+            self._due.append(entry)
+
+    def _index_remove(self, activity):
+        activity_id = activity['id']
+        for field in INDEXED_FIELDS:
+            ids = self._index[field][activity.get(field)]
+            ids.discard(activity_id)
+            if not ids:
+                del self._index[field][activity.get(field)]
+        position = bisect_left(self._due, (activity.get('due_date') or '', activity_id))
+        del self._due[position]
+
+    def _writable(self):
+        if self._own is not None:
+            self.activities, self._own = self._own(), None
+            # Indexen bygger på id och gäller även för kopian
+            self._by_id = {activity['id']: activity for activity in self.activities}
+
+    def get(self, activity_id):
+        return self._by_id.get(activity_id)
+
+    def add(self, activity):
+        """Lägg till en aktivitet (får ett id om den saknar ett)"""
+        self._writable()
+        activity.setdefault('id', new_activity_id())
+        self.activities.append(activity)
+        self._index_add(activity)
+        return activity
+
+    def extend(self, activities):
+        """Lägg till många aktiviteter; datumindexet sorteras om en gång"""
+        self._writable()
+        for activity in activities:
+            activity.setdefault('id', new_activity_id())
+            self._index_add(activity, sort=False)
+        self.activities.extend(activities)
+        self._due.sort()
+
+    def update(self, activity_id, **changes):
+        """Ändra fält på en aktivitet och uppdatera berörda index"""
+        self._writable()
+        activity = self._by_id[activity_id]
+        self._index_remove(activity)
+        activity.update(changes)
+        self._index_add(activity)
+        return activity
+
+    def remove(self, activity_id):
+        self._writable()
+        activity = self._by_id.pop(activity_id)
+        self._index_remove(activity)
+        self.activities.remove(activity)
+        return activity
+
+    def values(self, field):
+        """Förekommande värden för ett indexerat fält, sorterade"""
+        return sorted(v for v in self._index[field] if v)
+
+    def query(self, status=None, priority=None, responsible=None,
+              due_from=None, due_to=None, sort_by='due_date', order=None, descending=False):
+        """Aktiviteter som matchar alla angivna filter, i vald ordning
+
+        status, priority och responsible kan vara ett värde eller flera.
+        due_from/due_to (ÅÅÅÅ-MM-DD) är inkluderande. order anger en egen
+        sorteringsordning för sort_by, t.ex. PRIORITIES. Filtren slås upp i
+        indexen, så kostnaden växer med antalet träffar och inte med planen.
+        """
+        # Minsta filtret först; övriga filter prövas bara mot dess träffar
+        filters = []
+        for field, wanted in (('status', status), ('priority', priority), ('responsible', responsible)):
+            if wanted is not None:
+                sets = [self._index[field][v] for v in _values(wanted) if v in self._index[field]]
+                filters.append((sum(map(len, sets)), sets))
+        filters.sort(key=lambda f: f[0])
+        candidates = None
+        for _, sets in filters:
+            if candidates is None:
+                candidates = set().union(*sets)
+            else:
+                candidates = set().union(*(candidates & s for s in sets))
+
+        if sort_by == 'due_date' or due_from or due_to:
+            lo = bisect_left(self._due, (due_from,)) if due_from else 0
+            hi = bisect_right(self._due, (due_to, _MAX_ID)) if due_to else len(self._due)
+            if candidates is not None and len(candidates) < hi - lo:
+                # Få träffar: sortera träffarna i stället för att gå igenom intervallet
+                ordered = sorted(
+                    (self._by_id[i].get('due_date') or '', i) for i in candidates)
+                ordered = ordered[bisect_left(ordered, (due_from,)) if due_from else 0:
+                                  bisect_right(ordered, (due_to, _MAX_ID)) if due_to else len(ordered)]
+                ids = [i for _, i in ordered]
+            else:
+                ids = [i for _, i in self._due[lo:hi] if candidates is None or i in candidates]
+            if sort_by == 'due_date':
+                return [self._by_id[i] for i in (reversed(ids) if descending else ids)]
+            candidates = set(ids)
+        elif candidates is None:
+            candidates = self._by_id.keys()
+
+        matches = [self._by_id[i] for i in candidates]
+        if order:
+            rank = {value: i for i, value in enumerate(order)}
+            return sorted(matches, key=lambda a: rank.get(a.get(sort_by), len(rank)), reverse=descending)
+        return sorted(matches, key=lambda a: a.get(sort_by) or '', reverse=descending)
+
+    def overdue(self, today, done_status='Klar', **filters):
+        """Ej avslutade aktiviteter med deadline före today"""
+        open_statuses = [s for s in self._index['status'] if s != done_status]
+        yesterday = (today - timedelta(days=1)).strftime('%Y-%m-%d')
+        return self.query(status=open_statuses, due_to=yesterday, **filters)
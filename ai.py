@@ -0,0 +1,365 @@
+import itertools
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import google.generativeai as genai
+from google.api_core import exceptions as api_exceptions
+from google.generativeai import client as genai_client
+
+import ai_metrics
+from ai_cache import Flight, SingleFlight, cache_key, get_cache
+from llm_backends import POOL_SIZE, TIMEOUT, ClientPool, create_backend
+from ratelimit import CircuitBreaker, CircuitOpenError, RateLimiter, backoff
+
+DEFAULT_MODEL = 'gemini-pro'
+
+# Max antal samtidiga anrop när flera förfrågningar skickas på en gång
+CONCURRENCY = int(os.getenv('ISO_AI_CONCURRENCY', '9'))
+
+# Vilken språkmodell anropen går till: gemini (standard) eller local, en
+# lokal server på ISO_AI_LOCAL_URL (t.ex. fake_llm_server.py) för tester och
+# lasttester utan nätverk
+BACKEND = os.getenv('ISO_AI_BACKEND', 'gemini').lower()
+
+# Kvoter som delas av alla sessioner i processen: anrop och tokens per minut.
+# Tillfälliga fel försöks igen upp till RETRIES gånger; efter
+# ISO_AI_BREAKER_THRESHOLD fel i följd nekas anrop direkt i ISO_AI_BREAKER_RESET sekunder.
+RPM = int(os.getenv('ISO_AI_RPM', '60'))
+TPM = int(os.getenv('ISO_AI_TPM', '32000'))
+RETRIES = int(os.getenv('ISO_AI_RETRIES', '4'))
+MAX_WAIT = float(os.getenv('ISO_AI_MAX_WAIT', '120'))
+
+# Port för en /metrics-endpoint i Prometheus textformat (av om tom)
+METRICS_PORT = os.getenv('ISO_AI_METRICS_PORT')
+
+# Etikett i mätvärdena för anrop som inte anger någon
+DEFAULT_LABEL = 'other'
+
+limiter = RateLimiter(RPM, TPM)
+flights = SingleFlight()
+metrics = ai_metrics.AIMetrics()
+breaker = CircuitBreaker(int(os.getenv('ISO_AI_BREAKER_THRESHOLD', '5')),
+                         float(os.getenv('ISO_AI_BREAKER_RESET', '30')))
+
+# Tillfälliga fel som är värda ett nytt försök. Kvotfel betyder att vi ligger
+# vid taket och bromsar alla anrop; övriga tyder på att tjänsten mår dåligt
+# och räknas av brytaren.
+QUOTA_ERRORS = (api_exceptions.ResourceExhausted, api_exceptions.TooManyRequests)
+SERVICE_ERRORS = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+    api_exceptions.DeadlineExceeded,
+)
+RETRYABLE = QUOTA_ERRORS + SERVICE_ERRORS
+
+# Ungefärligt antal tokens per tecken respektive bild, för TPM-budgeten
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258
+
+
+class AIBusyError(Exception):
+    """Kvoten räckte inte till anropet inom ISO_AI_MAX_WAIT sekunder"""
+
+
+_backend = None
+_api_key = None
+_backend_lock = threading.Lock()
+
+
+def configure(api_key):
+    """Konfigurera Gemini en gång per process (och igen bara om nyckeln byts)
+
+    genai.configure kastar alla befintliga klienter, så det ska inte köras
+    vid varje omladdning av sidan. Med en lokal backend behövs ingen nyckel.
+    """
+    global _backend, _api_key
+    if BACKEND != 'gemini':
+        return
+    with _backend_lock:
+        if api_key != _api_key:
+            genai.configure(api_key=api_key)
+            _api_key = api_key
+            _backend = None
+
+
+def requires_api_key():
+    """Om anropen går till Gemini och därmed kräver GOOGLE_API_KEY"""
+    return BACKEND == 'gemini'
+
+
+def reset_backend():
+    """Släpp backend och dess anslutningar; nästa anrop börjar med nya (kalla) anslutningar"""
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+def get_backend():
+    """Processgemensam backend enligt ISO_AI_BACKEND (se llm_backends)"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend(BACKEND)
+        return _backend
+
+
+def estimate_tokens(contents):
+    """Uppskattat antal tokens för en prompt, lista med delar eller konversation"""
+    if isinstance(contents, str):
+        return len(contents) // CHARS_PER_TOKEN + 1
+    if isinstance(contents, dict):
+        if 'data' in contents:
+            return IMAGE_TOKENS
+        return estimate_tokens(contents.get('parts', []))
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(part) for part in contents)
+    return IMAGE_TOKENS
+
+
+def _call(request, tokens):
+    """Kör request() inom kvoterna, med återförsök och brytare
+
+    Bara tillfälliga fel (RETRYABLE) försöks igen. Ett kvotfel tömmer den
+    gemensamma anropsbudgeten så att alla sessioner saktar in tillsammans;
+    tjänstefel räknas av brytaren. Övriga fel, t.ex. en ogiltig förfrågan,
+    skickas vidare direkt.
+    """
+    for attempt in itertools.count():
+        breaker.before_call()
+        if not limiter.acquire(tokens, timeout=MAX_WAIT):
+            breaker.cancel()
+            raise AIBusyError(f"Ingen kvot ledig inom {MAX_WAIT:.0f} s")
+        try:
+            result = request()
+        except RETRYABLE as e:
+            if isinstance(e, QUOTA_ERRORS):
+                limiter.throttle()
+                breaker.cancel()
+            else:
+                breaker.record_failure()
+            if attempt >= RETRIES:
+                raise
+            time.sleep(backoff(attempt))
+        except Exception:
+            # T.ex. en ogiltig förfrågan: säger inget om tjänstens hälsa
+            breaker.cancel()
+            raise
+        else:
+            breaker.record_success()
+            return result
+
+
+def describe_error(error):
+    """Ett fel från AI-anropen som ett meddelande att visa för användaren"""
+    if isinstance(error, CircuitOpenError):
+        seconds = max(1, round(error.retry_after))
+        return f"AI-tjänsten svarar inte just nu. Försök igen om {seconds} sekund{'er' if seconds > 1 else ''}."
+    if isinstance(error, (AIBusyError, api_exceptions.ResourceExhausted, api_exceptions.TooManyRequests)):
+        return "Kvoten för AI-tjänsten är tillfälligt slut. Försök igen om en stund."
+    if isinstance(error, (api_exceptions.DeadlineExceeded, api_exceptions.ServiceUnavailable)):
+        return "AI-tjänsten svarade inte i tid. Försök igen om en stund."
+    return str(error)
+
+
+def _produce(flight, key, model, contents, generation_config, cache, streaming):
+    """Gör anropet åt alla som följer flight och cacha svaret
+
+    Fel sparas i flight och höjs hos dem som följer den, inte här.
+    """
+    tokens = estimate_tokens(contents)
+    try:
+        if streaming:
+            # Första biten hämtas redan i backendens stream, så fel innan något
+            # visats försöks igen; fel mitt i strömmen skickas vidare
+            chunks = _call(lambda: get_backend().stream(model, contents, generation_config), tokens)
+            try:
+                for chunk in chunks:
+                    flight.add(chunk)
+            except SERVICE_ERRORS:
+                breaker.record_failure()
+                raise
+        else:
+            flight.add(_call(lambda: get_backend().generate(model, contents, generation_config), tokens))
+        text = ''.join(flight.chunks)
+        limiter.record_usage(tokens, tokens + estimate_tokens(text))
+        response_cache = get_cache() if cache else None
+        if response_cache is not None:
+            response_cache.put(key, model, text)
+    except BaseException as e:
+        flights.finish(key, flight, e)
+        if not isinstance(e, Exception):
+            raise
+        return
+    flights.finish(key, flight)
+
+
+def _join(contents, model, generation_config, cache):
+    """(cachat svar, None, False, nyckel) eller (None, flight, ledare, nyckel)
+
+    Identiska förfrågningar som pågår samtidigt, t.ex. när flera sessioner
+    klickar på samma knapp, delar på ett anrop via flights; bara ledaren
+    gör anropet. cache=False gör alltid ett eget anrop.
+    """
+    if not cache:
+        return None, Flight(), True, None
+    key = cache_key(model, contents, generation_config)
+    response_cache = get_cache()
+    if response_cache is not None:
+        text = response_cache.get(key)
+        if text is not None:
+            return text, None, False, key
+    flight, leader = flights.join(key)
+    return None, flight, leader, key
+
+
+def generate(contents, model=DEFAULT_MODEL, generation_config=None, cache=True, label=DEFAULT_LABEL):
+    """Generera text med språkmodellen; identiska förfrågningar besvaras från cachen
+
+    contents är en prompt, en lista med delar (text och bilder) eller en
+    konversation. Misslyckade anrop cachas inte. cache=False går alltid
+    till API:et, t.ex. för att testa anslutningen. Samma förfrågan som
+    redan pågår i en annan tråd väntar in det anropet i stället. label
+    anger vad anropet gäller i mätvärdena (metrics).
+    """
+    call = metrics.start(label, model, estimate_tokens(contents))
+    source = 'cache'
+    try:
+        text, flight, leader, key = _join(contents, model, generation_config, cache)
+        if text is None:
+            source = 'api' if leader else 'shared'
+            if leader:
+                _produce(flight, key, model, contents, generation_config, cache, streaming=False)
+            text = ''.join(flight.follow())
+    except Exception as e:
+        call.end('error', error=e)
+        raise
+    call.end(source, estimate_tokens(text))
+    return text
+
+
+def stream(contents, model=DEFAULT_MODEL, generation_config=None, cache=True, label=DEFAULT_LABEL):
+    """Som generate men ger texten i bitar allteftersom modellen skickar dem
+
+    Ett cachat svar ges som en enda bit. Själva anropet görs i en egen tråd,
+    så det blir klart och cachas även om den som började läsa slutar, och
+    andra som ställt samma fråga samtidigt får samma bitar.
+    """
+    call = metrics.start(label, model, estimate_tokens(contents))
+    source = 'cache'
+    received = []
+    try:
+        text, flight, leader, key = _join(contents, model, generation_config, cache)
+        if text is not None:
+            chunks = [text]
+        else:
+            source = 'api' if leader else 'shared'
+            if leader:
+                threading.Thread(target=_produce, name='ai-stream', daemon=True,
+                                 args=(flight, key, model, contents, generation_config, cache, True)).start()
+            chunks = flight.follow()
+        for chunk in chunks:
+            call.first_chunk()
+            received.append(chunk)
+            yield chunk
+    except GeneratorExit:
+        call.end('cancelled', estimate_tokens(''.join(received)))
+        raise
+    except Exception as e:
+        call.end('error', error=e)
+        raise
+    call.end(source, estimate_tokens(''.join(received)))
+
+
+def generate_many(requests, max_workers=None, **kwargs):
+    """Skicka flera förfrågningar samtidigt; ger (nyckel, text, fel) när de blir klara
+
+    requests är {nyckel: contents}. Högst max_workers (standard
+    ISO_AI_CONCURRENCY) anrop pågår samtidigt, så den totala tiden blir
+    ungefär det långsammaste anropet i stället för summan, så länge
+    kvoterna räcker. Övriga argument skickas vidare till generate.
+    """
+    if not requests:
+        return
+    workers = max(1, min(max_workers or CONCURRENCY, len(requests)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ai') as pool:
+        futures = {pool.submit(generate, contents, **kwargs): key for key, contents in requests.items()}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+
+def metrics_text():
+    """Mätvärdena för AI-anropen i Prometheus textformat, med cachen och sammanslagna anrop"""
+    extra = [('ai_flights_saved_total', 'counter', 'Anrop som slagits ihop med ett pågående', flights.saved)]
+    response_cache = get_cache()
+    if response_cache is not None:
+        stats = response_cache.summary()
+        extra += [
+            ('ai_cache_hits_total', 'counter', 'Träffar i svarscachen', stats['hits']),
+            ('ai_cache_misses_total', 'counter', 'Missar i svarscachen', stats['misses']),
+            ('ai_cache_entries', 'gauge', 'Cachade svar på disk', stats['entries']),
+        ]
+    return metrics.render(extra)
+
+
+def serve_metrics(port=None):
+    """Starta /metrics på port (standard ISO_AI_METRICS_PORT) en gång per process; None om av"""
+    port = port or METRICS_PORT
+    if not port:
+        return None
+    return ai_metrics.serve(int(port), metrics_text)
+
+
+def conversation(messages):
+    """Chatthistorik ({'role': 'user'|'assistant', 'content': ...}) som Gemini-innehåll"""
+    return [{'role': 'model' if m['role'] == 'assistant' else 'user', 'parts': [m['content']]}
+            for m in messages]
+
+
+def benchmark(n=50, live=False):
+    """Jämför att bygga modell och klient per anrop med den delade poolen
+
+    Utan live mäts bara uppsättningen (konfiguration, modell, klient och
+    anslutningskanal). Med live görs även riktiga anrop, där en ny klient
+    per anrop dessutom kostar en ny TLS-anslutning.
+    """
+    api_key = os.getenv('GOOGLE_API_KEY') or 'benchmark'
+    prompt = 'Svara bara "OK".'
+
+    def per_call():
+        genai.configure(api_key=api_key)
+        model = genai.GenerativeModel(DEFAULT_MODEL)
+        if live:
+            return model.generate_content(prompt).text
+        return genai_client.get_default_generative_client()
+
+    def pooled():
+        model = pool.model(DEFAULT_MODEL)
+        if live:
+            return model.generate_content(prompt).text
+        return model._client
+
+    genai.configure(api_key=api_key)
+    pool = ClientPool(POOL_SIZE, TIMEOUT)
+    results = {}
+    for label, call in (('ny klient per anrop', per_call), ('delad pool', pooled)):
+        call()  # första anropet räknas inte
+        start = time.perf_counter()
+        for _ in range(n):
+            call()
+        results[label] = (time.perf_counter() - start) / n * 1000
+        print(f"{label:<22} {results[label]:8.2f} ms per anrop")
+    saved = results['ny klient per anrop'] - results['delad pool']
+    print(f"Sparat per anrop: {saved:.2f} ms")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 50, live='--live' in sys.argv)
+    else:
+        print("Användning: python ai.py benchmark [antal] [--live]")
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+CACHE_FILE = 'ai_cache.db'
+
+
+def normalize(value):
+    """Innehållet i en förfrågan som JSON-bara värden; bilder och bytes ersätts av sin hash"""
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, dict):
+        return {str(k): normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, (bytes, bytearray)):
+        return {'bytes': hashlib.sha256(value).hexdigest()}
+    if hasattr(value, 'tobytes') and hasattr(value, 'mode'):
+        # PIL-bild
+        return {'image': hashlib.sha256(value.tobytes()).hexdigest(), 'mode': value.mode,
+                'size': list(value.size)}
+    if hasattr(value, '__dict__'):
+        return normalize(vars(value))
+    return repr(value)
+
+
+def cache_key(model, contents, generation_config=None):
+    """Nyckel för en förfrågan: modell, innehåll och genereringsinställningar"""
+    payload = json.dumps([model, normalize(contents), normalize(generation_config)],
+                         sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """AI-svar i SQLite med tak på antal poster (LRU) och maxålder (TTL)
+
+    Cachen delas mellan processer och överlever omstarter. Statistiken över
+    träffar och missar gäller den här processen.
+    """
+
+    def __init__(self, path=CACHE_FILE, max_entries=1000, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+        self._stats_lock = threading.Lock()
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT NOT NULL, '
+                'response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def get(self, key):
+        """Cachat svar eller None; en träff räknas som senaste användning"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT response, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self._count('misses')
+                return None
+            response, created = row
+            if now - created > self.ttl:
+                conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._count('expired')
+                self._count('misses')
+                return None
+            conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        finally:
+            conn.close()
+        self._count('hits')
+        return response
+
+    def put(self, key, model, response):
+        """Spara ett svar och rensa utgångna och minst nyligen använda poster"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                         (key, model, response, now, now))
+            expired = conn.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl,)).rowcount
+            evicted = conn.execute(
+                'DELETE FROM responses WHERE key IN '
+                '(SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)).rowcount
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        self._count('expired', expired)
+        self._count('evicted', evicted)
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM responses')
+        finally:
+            conn.close()
+
+    def summary(self):
+        """Statistik för processen plus antal poster på disk"""
+        conn = self._connect()
+        try:
+            entries = conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        finally:
+            conn.close()
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        return {**stats, 'entries': entries, 'hit_rate': stats['hits'] / lookups if lookups else 0.0}
+
+
+class Flight:
+    """Ett pågående anrop vars svar kan läsas av flera samtidigt
+
+    Producenten lägger till bitar med add och avslutar med finish; varje
+    läsare får alla bitar från början via follow, även om den kom in sent.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def add(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done, self.error = True, error
+            self._cond.notify_all()
+
+    def follow(self):
+        """Ge bitarna allteftersom de kommer; producentens fel höjs även här"""
+        position = 0
+        while True:
+            with self._cond:
+                while position >= len(self.chunks) and not self.done:
+                    self._cond.wait()
+                if position >= len(self.chunks):
+                    if self.error is not None:
+                        raise self.error
+                    return
+                chunk = self.chunks[position]
+            position += 1
+            yield chunk
+
+
+class SingleFlight:
+    """Slår ihop identiska förfrågningar som pågår samtidigt till ett anrop
+
+    Den första med en viss nyckel blir ledare och gör anropet; övriga som
+    kommer innan det är klart följer samma Flight i stället för att göra
+    egna. saved räknar anropen som därmed aldrig gjordes.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.saved = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """(flight, leder) för nyckeln; ledaren måste anropa finish när den är klar"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.saved += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            self.calls += 1
+            return flight, True
+
+    def finish(self, key, flight, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(error)
+
+    def summary(self):
+        with self._lock:
+            return {'calls': self.calls, 'saved': self.saved, 'in_flight': len(self._flights)}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Processgemensam ResponseCache, eller None om cachen är avstängd
+
+    Styrs av ISO_AI_CACHE_FILE, ISO_AI_CACHE_SIZE (0 stänger av) och
+    ISO_AI_CACHE_TTL (sekunder).
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            size = int(os.getenv('ISO_AI_CACHE_SIZE', '1000'))
+            if size <= 0:
+                return None
+            _cache = ResponseCache(os.getenv('ISO_AI_CACHE_FILE', CACHE_FILE), size,
+                                   float(os.getenv('ISO_AI_CACHE_TTL', str(7 * 24 * 3600))))
+        return _cache
+
+
+if __name__ == "__main__":
+    response_cache = get_cache()
+    if response_cache is None:
+        print("AI-cachen är avstängd (ISO_AI_CACHE_SIZE=0).")
+    elif len(sys.argv) > 1 and sys.argv[1] == 'clear':
+        response_cache.clear()
+        print("AI-cachen är tömd.")
+    else:
+        print(f"{response_cache.summary()['entries']} cachade svar i {response_cache.path}")
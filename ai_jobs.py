@@ -0,0 +1,177 @@
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import ai
+from storage import get_storage, get_writer
+
+# Antal AI-jobb som körs samtidigt i processen, antal avslutade jobb som
+# hålls i minnet och hur ofta (sekunder) en sida med pågående jobb laddas om
+WORKERS = int(os.getenv('ISO_AI_JOB_WORKERS', str(ai.CONCURRENCY)))
+HISTORY = int(os.getenv('ISO_AI_JOB_HISTORY', '200'))
+POLL_INTERVAL = float(os.getenv('ISO_AI_JOB_POLL', '1.0'))
+
+# Toppnivånyckel i planen där färdiga AI-svar sparas: {nyckel: {'text', 'finished', ...}}
+RESULTS_KEY = 'ai_results'
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """Ett AI-anrop som körs i bakgrunden
+
+    status är queued, running, done eller failed. text växer allteftersom
+    svaret strömmas in, så att en sida kan visa det som hunnit komma.
+    """
+
+    def __init__(self, workspace, key, title=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.workspace = workspace
+        self.key = key
+        self.title = title or key
+        self.status = 'queued'
+        self.text = ''
+        self.note = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    @property
+    def seconds(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+class JobQueue:
+    """Processgemensam kö för AI-jobb med en pool av arbetartrådar
+
+    Ett jobb överlever omladdningar och sidbyten eftersom det inte körs i
+    sidans tråd. Färdiga svar sparas i planen (RESULTS_KEY) och syns därmed
+    för alla sessioner i arbetsytan, även efter omstart. Ett nytt jobb för
+    samma arbetsyta och nyckel som redan köar eller körs startas inte igen.
+    """
+
+    def __init__(self, workers=WORKERS, history=HISTORY):
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='ai-job')
+        self._jobs = OrderedDict()
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def submit(self, workspace, key, prompt, title=None):
+        """Köa ett jobb och returnera det direkt
+
+        prompt är innehållet som ska skickas, eller en funktion som
+        returnerar (innehåll, anteckning) och då körs i bakgrunden, t.ex.
+        när själva prompten är dyr att bygga.
+        """
+        with self._lock:
+            job = self._latest.get((workspace, key))
+            if job is not None and job.active:
+                return job
+            job = Job(workspace, key, title)
+            self._jobs[job.id] = job
+            self._latest[workspace, key] = job
+            self._trim()
+        self._executor.submit(self._run, job, prompt)
+        return job
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+            job = self._jobs.pop(job_id)
+            if self._latest.get((job.workspace, job.key)) is job:
+                del self._latest[job.workspace, job.key]
+
+    def _run(self, job, prompt):
+        job.status, job.started = 'running', time.time()
+        try:
+            if callable(prompt):
+                prompt, job.note = prompt()
+            # Etiketten i mätvärdena är nyckelns typ, t.ex. step för step:3
+            for chunk in ai.stream(prompt, label=job.key.split(':')[0]):
+                job.text += chunk
+            save_result(job)
+            job.status = 'done'
+        except Exception as e:
+            logger.exception("AI-jobbet %s (%s) misslyckades", job.id, job.key)
+            job.error, job.status = e, 'failed'
+        finally:
+            job.finished = time.time()
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def latest(self, workspace, key):
+        """Senaste jobbet för nyckeln i arbetsytan, eller None"""
+        return self._latest.get((workspace, key))
+
+    def jobs(self, workspace=None):
+        """Jobben i den ordning de köades, valfritt bara för en arbetsyta"""
+        with self._lock:
+            return [job for job in self._jobs.values() if workspace is None or job.workspace == workspace]
+
+    def active(self, workspace=None):
+        return [job for job in self.jobs(workspace) if job.active]
+
+
+# Egna backend-instanser för läsning respektive skrivning, så att jobbens
+# sparningar inte påverkar sessionernas bas för sammanfogning
+_readers = {}
+_writers = {}
+_storage_lock = threading.Lock()
+
+
+def _storage(instances, workspace):
+    with _storage_lock:
+        if workspace not in instances:
+            instances[workspace] = get_storage(workspace)
+        return instances[workspace]
+
+
+def save_result(job):
+    """Spara jobbets svar i arbetsytans plan, sammanfogat med andras ändringar"""
+    result = {'text': job.text, 'finished': datetime.now().isoformat(timespec='seconds'), 'job': job.id}
+    if job.note:
+        result['note'] = job.note
+
+    def change(data):
+        data.setdefault(RESULTS_KEY, {})[job.key] = result
+
+    get_writer().update(_storage(_writers, job.workspace), change)
+
+
+def saved_results(workspace):
+    """Sparade AI-svar i arbetsytan: {nyckel: {'text', 'finished', ...}}; får inte ändras"""
+    return _storage(_readers, workspace).load_shared().get(RESULTS_KEY, {})
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """Processgemensam JobQueue (ISO_AI_JOB_WORKERS)"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(WORKERS, HISTORY)
+        return _queue
+
+
+if __name__ == "__main__":
+    # Visa sparade AI-svar i en arbetsyta
+    for key, result in sorted(saved_results(sys.argv[1] if len(sys.argv) > 1 else 'default').items()):
+        print(f"{key:<12} {result['finished']}  {len(result['text'])} tecken")
@@ -0,0 +1,252 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Övre gränser (sekunder) för hinkarna i latenshistogrammen
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+# Pris i USD per miljon tokens in respektive ut, för kostnadsuppskattningen
+PRICE_INPUT = float(os.getenv('ISO_AI_PRICE_INPUT', '0.5'))
+PRICE_OUTPUT = float(os.getenv('ISO_AI_PRICE_OUTPUT', '1.5'))
+
+# Varifrån ett svar kom: api (eget anrop), cache, shared (sammanslaget med
+# ett pågående anrop), error (misslyckades) eller cancelled (läsaren slutade)
+SOURCES = ('api', 'cache', 'shared', 'error', 'cancelled')
+
+_BOUNDS = [f'{bound:g}' for bound in BUCKETS] + ['+Inf']
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """Antal observationer per hink (BUCKETS), plus summa och antal"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Uppskattad kvantil (0–1), interpolerad inom hinken som Prometheus histogram_quantile"""
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if n and cumulative + n >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                low = self.buckets[i - 1] if i else 0.0
+                return low + (self.buckets[i] - low) * (rank - cumulative) / n
+            cumulative += n
+        return 0.0
+
+
+class CallStats:
+    """Samlade mätvärden för en etikett, modell och källa"""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.cost = 0.0
+        self.seconds = Histogram()
+        self.ttft = Histogram()
+
+
+class Call:
+    """Ett pågående AI-anrop som mäts från start tills end anropas"""
+
+    def __init__(self, metrics, label, model, prompt_tokens):
+        self._metrics = metrics
+        self.label = label
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.start = time.perf_counter()
+        self.ttft = None
+
+    def first_chunk(self):
+        """Markera att första biten av svaret kom (bara för strömmade anrop)"""
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.start
+
+    def end(self, source, response_tokens=0, error=None):
+        self._metrics.record(self.label, self.model, source, time.perf_counter() - self.start, self.ttft,
+                             self.prompt_tokens, response_tokens, error)
+
+
+class AIMetrics:
+    """Latens, tokens, kostnad och fel per AI-anrop, i minnet för processen
+
+    Anropen grupperas på etikett (vilken funktion som frågar, t.ex. step
+    eller plan), modell och källa (SOURCES). Tokens och kostnad räknas bara
+    för egna anrop till modellen; cacheträffar och sammanslagna anrop kostar
+    inget. Antalen tokens är samma uppskattning som kvoterna använder.
+    """
+
+    def __init__(self, price_input=PRICE_INPUT, price_output=PRICE_OUTPUT):
+        self.price_input = price_input
+        self.price_output = price_output
+        self.started = time.time()
+        self._stats = {}
+        self._errors = Counter()
+        self._lock = threading.Lock()
+
+    def start(self, label, model, prompt_tokens):
+        return Call(self, label, model, prompt_tokens)
+
+    def cost(self, prompt_tokens, response_tokens):
+        return (prompt_tokens * self.price_input + response_tokens * self.price_output) / 1_000_000
+
+    def record(self, label, model, source, seconds, ttft=None, prompt_tokens=0, response_tokens=0, error=None):
+        with self._lock:
+            stats = self._stats.get((label, model, source))
+            if stats is None:
+                stats = self._stats[label, model, source] = CallStats()
+            stats.calls += 1
+            stats.seconds.observe(seconds)
+            if ttft is not None:
+                stats.ttft.observe(ttft)
+            if source == 'api':
+                stats.prompt_tokens += prompt_tokens
+                stats.response_tokens += response_tokens
+                stats.cost += self.cost(prompt_tokens, response_tokens)
+            if error is not None:
+                self._errors[label, model, type(error).__name__] += 1
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._errors.clear()
+            self.started = time.time()
+
+    def rows(self):
+        """En rad per etikett och modell, långsammast (p95 för egna anrop) först"""
+        with self._lock:
+            groups = {}
+            for (label, model, source), stats in self._stats.items():
+                groups.setdefault((label, model), {})[source] = stats
+            rows = []
+            for (label, model), by_source in groups.items():
+                api = by_source.get('api', CallStats())
+                rows.append({
+                    'label': label,
+                    'model': model,
+                    'calls': sum(s.calls for s in by_source.values()),
+                    **{source: by_source[source].calls if source in by_source else 0 for source in SOURCES},
+                    'p50': api.seconds.quantile(0.5),
+                    'p95': api.seconds.quantile(0.95),
+                    'ttft_p50': api.ttft.quantile(0.5) if api.ttft.count else None,
+                    'prompt_tokens': api.prompt_tokens / api.calls if api.calls else 0,
+                    'response_tokens': api.response_tokens / api.calls if api.calls else 0,
+                    'cost': sum(s.cost for s in by_source.values()),
+                })
+        return sorted(rows, key=lambda row: row['p95'], reverse=True)
+
+    def render(self, extra=()):
+        """Mätvärdena i Prometheus textformat
+
+        extra är (namn, typ, hjälptext, värde) för ytterligare värden, t.ex.
+        cachens träffar, som läggs till sist.
+        """
+        lines = []
+
+        def family(name, kind, text):
+            lines.extend([f'# HELP {name} {text}', f'# TYPE {name} {kind}'])
+
+        def histogram(name, key, hist):
+            cumulative = 0
+            for bound, n in zip(_BOUNDS, hist.counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{{{key},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{key}}} {hist.sum:.6f}')
+            lines.append(f'{name}_count{{{key}}} {hist.count}')
+
+        with self._lock:
+            stats = sorted(self._stats.items())
+            errors = sorted(self._errors.items())
+            family('ai_calls_total', 'counter', 'AI-anrop per etikett, modell och källa')
+            for key, s in stats:
+                lines.append(f'ai_calls_total{{{_labels(key)}}} {s.calls}')
+            family('ai_call_seconds', 'histogram', 'Total tid per AI-anrop i sekunder')
+            for key, s in stats:
+                histogram('ai_call_seconds', _labels(key), s.seconds)
+            family('ai_time_to_first_token_seconds', 'histogram', 'Tid till första biten för strömmade anrop')
+            for key, s in stats:
+                if s.ttft.count:
+                    histogram('ai_time_to_first_token_seconds', _labels(key), s.ttft)
+            for name, attribute, text in (
+                    ('ai_prompt_tokens_total', 'prompt_tokens', 'Uppskattade tokens in för egna anrop'),
+                    ('ai_response_tokens_total', 'response_tokens', 'Uppskattade tokens ut för egna anrop'),
+                    ('ai_cost_usd_total', 'cost', 'Uppskattad kostnad i USD för egna anrop')):
+                family(name, 'counter', text)
+                for key, s in stats:
+                    if key[2] == 'api':
+                        lines.append(f'{name}{{{_labels(key[:2])}}} {getattr(s, attribute):g}')
+            family('ai_errors_total', 'counter', 'Misslyckade AI-anrop per feltyp')
+            for (label, model, error), n in errors:
+                lines.append(f'ai_errors_total{{{_labels((label, model))},type="{_escape(error)}"}} {n}')
+        for name, kind, text, value in extra:
+            family(name, kind, text)
+            lines.append(f'{name} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(key):
+    names = ('label', 'model', 'source')
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, key))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Svarar på GET /metrics med server.render()"""
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve(port, render, host='0.0.0.0'):
+    """Starta en /metrics-endpoint i en bakgrundstråd, en gång per process
+
+    render anropas vid varje skrapning och ska returnera texten. Går
+    porten inte att öppna loggas det och appen fortsätter utan endpoint.
+    """
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server or None
+        try:
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            logger.warning("Kunde inte starta /metrics på port %s: %s", port, e)
+            _server = False
+            return None
+        _server.daemon_threads = True
+        _server.render = render
+        threading.Thread(target=_server.serve_forever, name='ai-metrics', daemon=True).start()
+        return _server
@@ -1,23 +1,26 @@
 import streamlit as st
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
-from PIL import Image
+import ai
+from image_prep import prepared
 import io
+import time
+import itertools
+from chat_history import ChatHistory
 
 # Ladda miljövariabler
 load_dotenv()
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-genai.configure(api_key=GOOGLE_API_KEY)
+ai.configure(GOOGLE_API_KEY)
 
 # Testa API-anslutning
 try:
-    model = genai.GenerativeModel('gemini-pro')
-    response = model.generate_content('Ping test: Svara "OK" om du får detta meddelande.')
+    # Ingen cache här: svaret ska visa att API:et faktiskt går att nå
+    response = ai.generate('Ping test: Svara "OK" om du får detta meddelande.', cache=False, label='ping')
     st.success("✅ API-anslutning fungerar!")
-    st.write("Svar från API:", response.text)
+    st.write("Svar från API:", response)
 except Exception as e:
-    st.error(f"❌ Kunde inte ansluta till API:et. Fel: {str(e)}")
+    st.error(f"❌ Kunde inte ansluta till API:et. Fel: {ai.describe_error(e)}")
 
 # Konfigurera Streamlit sida
 st.set_page_config(
@@ -87,14 +90,13 @@ def text_generation_demo():
         if prompt:
             with st.spinner("✨ Genererar svar..."):
                 try:
-                    model = genai.GenerativeModel('gemini-pro')
-                    response = model.generate_content(prompt)
+                    response = ai.generate(prompt, label='text')
                     st.markdown("### Resultat")
                     st.markdown('<div class="output-container">', unsafe_allow_html=True)
-                    st.markdown(response.text)
+                    st.markdown(response)
                     st.markdown('</div>', unsafe_allow_html=True)
                 except Exception as e:
-                    st.error(f"Ett fel uppstod: {str(e)}")
+                    st.error(f"Ett fel uppstod: {ai.describe_error(e)}")
         else:
             st.warning("⚠️ Skriv en prompt först!")
 
@@ -108,8 +110,10 @@ def vision_demo():
     with col1:
         uploaded_file = st.file_uploader("📤 Ladda upp en bild", type=['png', 'jpg', 'jpeg'])
         if uploaded_file:
-            image = Image.open(uploaded_file)
-            st.image(image, caption="Din bild", use_column_width=True)
+            # Förbehandlas en gång per bild (cachad på innehållet), inte vid varje omladdning
+            image = prepared(uploaded_file.getvalue())
+            st.image(image.image, caption="Din bild", use_column_width=True)
+            st.caption(f"📉 {image.report()}")
     
     with col2:
         prompt = st.text_area("Din fråga om bilden:", height=150,
@@ -118,27 +122,35 @@ def vision_demo():
             if st.button("🔍 Analysera"):
                 with st.spinner("🤔 Analyserar bild..."):
                     try:
-                        model = genai.GenerativeModel('gemini-pro-vision')
-                        response = model.generate_content([prompt, image])
+                        # Den förbehandlade bilden skickas som den är, utan ny omkodning
+                        start = time.perf_counter()
+                        response = ai.generate([prompt, image.blob()], model='gemini-pro-vision',
+                                               label='vision')
+                        st.caption(f"⏱️ Svar på {time.perf_counter() - start:.1f} s")
                         st.markdown("### Analys")
                         st.markdown('<div class="output-container">', unsafe_allow_html=True)
-                        st.markdown(response.text)
+                        st.markdown(response)
                         st.markdown('</div>', unsafe_allow_html=True)
                     except Exception as e:
-                        st.error(f"Ett fel uppstod: {str(e)}")
+                        st.error(f"Ett fel uppstod: {ai.describe_error(e)}")
 
 # Chat Demo
 def chat_demo():
     st.header("💬 Chat med Gemini Pro")
     st.markdown("Ha en interaktiv konversation med AI:n.")
     
-    # Initiera chat-historik i session state
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-        st.session_state.chat = genai.GenerativeModel('gemini-pro').start_chat(history=[])
+    # Initiera chat-historik i session state; äldre delar av samtalet
+    # sammanfattas så att historiken inte växer obegränsat
+    if "chat" not in st.session_state:
+        st.session_state.chat = ChatHistory()
+    chat = st.session_state.chat
+    chat.refresh()
 
     # Visa chat-historik
-    for message in st.session_state.messages:
+    if chat.summary:
+        with st.expander(f"📝 Tidigare i samtalet ({chat.folded // 2} frågor sammanfattade)"):
+            st.markdown(chat.summary)
+    for message in chat.messages:
         role = "🤖 AI" if message["role"] == "assistant" else "👤 Du"
         with st.chat_message(message["role"]):
             st.markdown(f"**{role}:** {message['content']}")
@@ -149,20 +161,24 @@ def chat_demo():
         # Visa användarens meddelande
         with st.chat_message("user"):
             st.markdown(f"👤 **Du:** {prompt}")
-        st.session_state.messages.append({"role": "user", "content": prompt})
         
         # Generera och visa AI:s svar
         with st.chat_message("assistant"):
-            with st.spinner("🤔 Tänker..."):
-                try:
-                    response = st.session_state.chat.send_message(prompt)
-                    st.markdown(f"🤖 **AI:** {response.text}")
-                    st.session_state.messages.append({"role": "assistant", "content": response.text})
-                except Exception as e:
-                    st.error(f"Ett fel uppstod: {str(e)}")
+            try:
+                # Sammanfattningen och de senaste meddelandena skickas med, så samma fråga
+                # i samma sammanhang kan cachas. Svaret strömmas in bit för bit efter rubriken.
+                label = "🤖 **AI:** "
+                chunks = ai.stream(chat.contents(prompt), label='chat')
+                response = st.write_stream(itertools.chain([label], chunks))[len(label):]
+                chat.add(prompt, response)
+            except Exception as e:
+                st.error(f"Ett fel uppstod: {ai.describe_error(e)}")
+                return
+        # Sammanfattningen körs i bakgrunden och fördröjer varken det här svaret eller nästa
+        chat.compact()
 
 # Kör vald demo
-if not GOOGLE_API_KEY:
+if not GOOGLE_API_KEY and ai.requires_api_key():
     st.error("❌ Ingen API-nyckel hittad. Skapa en .env fil med din GOOGLE_API_KEY.")
 else:
     # Ta bort emoji från demo_type för att matcha
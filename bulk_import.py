@@ -0,0 +1,126 @@
+import csv
+import io
+import os
+import sys
+import time
+
+import pandas as pd
+
+from storage import get_storage, new_activity_ids
+
+PRIORITIES = ["Hög", "Medium", "Låg"]
+STATUSES = ["Ej påbörjad", "Pågående", "Klar"]
+
+# Kolumnnamn som accepteras i importfilen (svenska eller engelska)
+COLUMN_ALIASES = {
+    'aktivitet': 'activity',
+    'activity': 'activity',
+    'prioritet': 'priority',
+    'priority': 'priority',
+    'status': 'status',
+    'deadline': 'due_date',
+    'due_date': 'due_date',
+    'ansvarig': 'responsible',
+    'responsible': 'responsible',
+}
+REQUIRED_COLUMNS = ['activity', 'priority', 'due_date', 'responsible']
+
+
+def read_activities(file, filename):
+    """Läs en CSV- eller XLSX-fil till en DataFrame med normaliserade kolumner"""
+    if filename.lower().endswith('.xlsx'):
+        df = pd.read_excel(file, dtype=str, engine='openpyxl')
+    else:
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, 'rb') as f:
+                raw = f.read()
+        else:
+            raw = file.read()
+        text = raw.decode('utf-8-sig') if isinstance(raw, bytes) else raw
+        # Avgör avgränsaren (komma/semikolon) från rubrikraden och läs med C-parsern;
+        # en rubrik med en enda kolumn (eller ingen) ger inget att gissa på
+        try:
+            delimiter = csv.Sniffer().sniff(text.split('\n', 1)[0], delimiters=',;\t').delimiter
+        except csv.Error:
+            delimiter = ','
+        df = pd.read_csv(io.StringIO(text), dtype=str, sep=delimiter)
+    df.columns = [COLUMN_ALIASES.get(str(c).strip().lower(), str(c).strip().lower()) for c in df.columns]
+    return df
+
+
+def validate_activities(df):
+    """Validera alla rader på en gång
+
+    Returnerar (aktiviteter, fel) där fel är en DataFrame med radnummer, fält
+    och felmeddelande. Aktiviteterna ska bara användas om fel är tom.
+    """
+    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    if missing:
+        errors = pd.DataFrame({'rad': 1, 'fält': missing, 'fel': 'Kolumnen saknas'})
+        return [], errors
+
+    # Radnummer i filen: rubrikraden är rad 1
+    row_numbers = pd.Series(df.index + 2, index=df.index)
+    text = {c: df[c].fillna('').str.strip() for c in REQUIRED_COLUMNS}
+    status = df['status'].fillna('').str.strip() if 'status' in df.columns else pd.Series('', index=df.index)
+    status = status.mask(status == '', STATUSES[0])
+    due_date = pd.to_datetime(text['due_date'], format='ISO8601', errors='coerce')
+
+    checks = [
+        ('activity', text['activity'] == '', "Aktivitet saknas"),
+        ('responsible', text['responsible'] == '', "Ansvarig saknas"),
+        ('priority', ~text['priority'].isin(PRIORITIES), f"Prioritet måste vara en av {', '.join(PRIORITIES)}"),
+        ('status', ~status.isin(STATUSES), f"Status måste vara en av {', '.join(STATUSES)}"),
+        ('due_date', due_date.isna(), "Deadline måste vara ett datum (ÅÅÅÅ-MM-DD)"),
+    ]
+    errors = pd.concat([
+        pd.DataFrame({'rad': row_numbers[mask], 'fält': field, 'fel': message})
+        for field, mask, message in checks
+    ]).sort_values(['rad', 'fält'], kind='stable').reset_index(drop=True)
+    if not errors.empty:
+        return [], errors
+
+    columns = {
+        'id': new_activity_ids(len(df)),
+        'activity': text['activity'].tolist(),
+        'priority': text['priority'].tolist(),
+        'due_date': due_date.dt.strftime('%Y-%m-%d').tolist(),
+        'responsible': text['responsible'].tolist(),
+        'status': status.tolist(),
+    }
+    activities = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    return activities, errors
+
+
+def import_activities(file, filename):
+    """Läs och validera en importfil; returnerar (aktiviteter, fel, rader per sekund)
+
+    En fil som inte går att läsa (tom, trasig eller i fel format) ger ett
+    fel på rad 0 i stället för ett undantag.
+    """
+    start = time.perf_counter()
+    try:
+        df = read_activities(file, filename)
+    except Exception as e:
+        errors = pd.DataFrame({'rad': [0], 'fält': ['fil'], 'fel': [f"Kunde inte läsa filen: {e}"]})
+        return [], errors, 0.0
+    activities, errors = validate_activities(df)
+    elapsed = time.perf_counter() - start
+    return activities, errors, len(df) / elapsed if elapsed else float('inf')
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Användning: python bulk_import.py fil.csv|fil.xlsx [arbetsyta]")
+        sys.exit(1)
+    path = sys.argv[1]
+    activities, errors, rate = import_activities(path, os.path.basename(path))
+    if not errors.empty:
+        print(errors.to_string(index=False))
+        print(f"\n{len(errors)} fel hittades – inget importerades.")
+        sys.exit(1)
+    storage = get_storage(sys.argv[2] if len(sys.argv) > 2 else 'default')
+    plan = storage.load()
+    plan.setdefault('activities', []).extend(activities)
+    storage.save(plan)
+    print(f"Importerade {len(activities)} aktiviteter ({rate:,.0f} rader/s).")
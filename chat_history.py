@@ -0,0 +1,130 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import ai
+
+# Minst ISO_CHAT_TURNS och högst ISO_CHAT_TURNS + FOLD_TURNS - 1 av de
+# senaste frågorna och svaren skickas ordagrant, högst ISO_CHAT_HISTORY_TOKENS
+# tokens. Äldre delar av samtalet viks in i en löpande sammanfattning på
+# högst ISO_CHAT_SUMMARY_TOKENS tokens.
+TURNS = int(os.getenv('ISO_CHAT_TURNS', '6'))
+HISTORY_TOKENS = int(os.getenv('ISO_CHAT_HISTORY_TOKENS', '3000'))
+SUMMARY_TOKENS = int(os.getenv('ISO_CHAT_SUMMARY_TOKENS', '400'))
+
+# Antal extra frågor och svar som samlas innan de sammanfattas, så att det
+# inte blir ett sammanfattningsanrop efter varje svar
+FOLD_TURNS = 4
+
+# Sammanfattningarna körs i bakgrunden så att de inte fördröjer något svar
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='chat-summary')
+
+
+def _transcript(messages):
+    return [f"{'AI' if m['role'] == 'assistant' else 'Användaren'}: {m['content']}" for m in messages]
+
+
+def _summary_prompt(summary, messages, words):
+    previous = f"Sammanfattning hittills:\n{summary}\n\n" if summary else ''
+    return f"""
+        Sammanfatta samtalet nedan på svenska med högst {words} ord, så att det kan
+        fortsättas utan den ursprungliga texten. Behåll fakta, beslut, namn, siffror och
+        öppna frågor; utelämna artighetsfraser.
+
+        {previous}Fortsättning av samtalet:
+        {chr(10).join(_transcript(messages))}
+        """
+
+
+def _fold(summary, messages, summary_tokens):
+    """Ny sammanfattning med messages invikta; kortar texten om AI-anropet misslyckas"""
+    limit = summary_tokens * ai.CHARS_PER_TOKEN
+    try:
+        summary = ai.generate(_summary_prompt(summary, messages, int(summary_tokens * 0.75)),
+                              generation_config={'max_output_tokens': summary_tokens},
+                              label='chat_summary')
+    except Exception:
+        summary = '\n'.join(filter(None, [summary] + _transcript(messages)))[-limit:]
+    return summary.strip()[:limit]
+
+
+class ChatHistory:
+    """Chatthistorik med begränsad storlek
+
+    De senaste turns frågorna och svaren (inom history_tokens) sparas
+    ordagrant; äldre viks in i en löpande sammanfattning, FOLD_TURNS åt
+    gången. Både det som skickas till modellen och det som sparas i
+    sessionen håller sig därmed på samma storlek hur långt samtalet än blir.
+    """
+
+    def __init__(self, turns=TURNS, history_tokens=HISTORY_TOKENS, summary_tokens=SUMMARY_TOKENS):
+        self.turns = max(1, turns)
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.messages = []
+        self.summary = ''
+        self.folded = 0
+        # Pågående sammanfattning i bakgrunden: (future, antal meddelanden)
+        self._pending = None
+
+    def add(self, prompt, response):
+        """Spara en besvarad fråga; obesvarade frågor sparas inte"""
+        self.messages += [{'role': 'user', 'content': prompt}, {'role': 'assistant', 'content': response}]
+
+    def contents(self, prompt):
+        """Det som skickas till modellen: sammanfattningen, de senaste meddelandena och prompt"""
+        self.refresh()
+        messages = self.messages + [{'role': 'user', 'content': prompt}]
+        if not self.summary:
+            return ai.conversation(messages)
+        # Gemini vill ha växelvis användare och modell, med användaren först
+        preamble = [
+            {'role': 'user', 'content': f"Sammanfattning av vårt samtal hittills:\n{self.summary}"},
+            {'role': 'assistant', 'content': 'Uppfattat, jag fortsätter utifrån det.'},
+        ]
+        return ai.conversation(preamble + messages)
+
+    def _overflow(self):
+        """Antal meddelanden i början som ska vikas in, i hela par av fråga och svar"""
+        turns = len(self.messages) // 2
+        fold = turns - self.turns if turns >= self.turns + FOLD_TURNS else 0
+        # Håll också tokenbudgeten, men behåll alltid den senaste frågan och svaret
+        tokens = ai.estimate_tokens([m['content'] for m in self.messages[2 * fold:]])
+        while tokens > self.history_tokens and fold < turns - 1:
+            tokens -= ai.estimate_tokens([m['content'] for m in self.messages[2 * fold:2 * fold + 2]])
+            fold += 1
+        return 2 * fold
+
+    def compact(self):
+        """Börja vika in äldre meddelanden i sammanfattningen, i bakgrunden
+
+        Returnerar direkt; resultatet förs in av refresh (som contents
+        anropar), och fram till dess skickas meddelandena ordagrant. Högst
+        en sammanfattning per historik pågår åt gången.
+        """
+        self.refresh()
+        if self._pending is not None:
+            return False
+        count = self._overflow()
+        if not count:
+            return False
+        future = _executor.submit(_fold, self.summary, self.messages[:count], self.summary_tokens)
+        self._pending = (future, count)
+        return True
+
+    def refresh(self):
+        """För in en sammanfattning som blivit klar i bakgrunden; returnerar om det fanns en"""
+        if self._pending is None or not self._pending[0].done():
+            return False
+        future, count = self._pending
+        self._pending = None
+        # Nya meddelanden läggs bara till sist, så de count första är de som sammanfattades
+        self.summary = future.result()
+        self.messages = self.messages[count:]
+        self.folded += count
+        return True
+
+    def clear(self):
+        self._pending = None
+        self.messages = []
+        self.summary = ''
+        self.folded = 0
@@ -0,0 +1,140 @@
+import csv
+import io
+import json
+import sys
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+ACTIVITY_FIELDS = ['id', 'activity', 'priority', 'status', 'due_date', 'responsible']
+
+
+def _activity_rows(data):
+    return data.get('activities', [])
+
+
+def _checklist_rows(data):
+    for section, items in data.get('checklists', {}).items():
+        for item, done in items.items():
+            yield {'section': section, 'item': item, 'done': done}
+
+
+def _step_rows(data):
+    for step, done in data.get('step_progress', {}).items():
+        yield {'step': step, 'done': done}
+
+
+def _organisation_rows(data):
+    for field, value in data.get('organisation_info', {}).items():
+        yield {'field': field, 'value': value}
+
+
+# Sektion -> (bladnamn, kolumner, radgenerator)
+SECTIONS = {
+    'activities': ('Aktiviteter', ACTIVITY_FIELDS, _activity_rows),
+    'checklists': ('Checklistor', ['section', 'item', 'done'], _checklist_rows),
+    'step_progress': ('Implementeringssteg', ['step', 'done'], _step_rows),
+    'organisation_info': ('Organisation', ['field', 'value'], _organisation_rows),
+}
+
+
+def iter_json(data):
+    """Kompakt JSON, en sektion (och en aktivitet) i taget"""
+    yield '{'
+    for index, (key, value) in enumerate(data.items()):
+        yield (',' if index else '') + _encode(key) + ':'
+        if key == 'activities' and isinstance(value, list):
+            yield '['
+            for position, activity in enumerate(value):
+                yield (',' if position else '') + _encode(activity)
+            yield ']'
+        else:
+            yield _encode(value)
+    yield '}'
+
+
+def iter_ndjson(data):
+    """En JSON-post per rad: organisation, checklistepunkter, steg och aktiviteter"""
+    yield _encode({'type': 'organisation_info', **data.get('organisation_info', {})}) + '\n'
+    for row in _checklist_rows(data):
+        yield _encode({'type': 'checklist', **row}) + '\n'
+    for row in _step_rows(data):
+        yield _encode({'type': 'step', **row}) + '\n'
+    for activity in _activity_rows(data):
+        yield _encode({'type': 'activity', **activity}) + '\n'
+
+
+def iter_csv(data, section):
+    """CSV för en sektion, i bitar om ungefär CHUNK_SIZE tecken"""
+    _, fields, rows = SECTIONS[section]
+    buffer = io.StringIO()
+    # BOM så att Excel tolkar å, ä och ö rätt
+    buffer.write('\ufeff')
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows(data):
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_xlsx(data):
+    """XLSX med ett blad per sektion (openpyxl i write-only-läge)"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for title, fields, rows in SECTIONS.values():
+        sheet = workbook.create_sheet(title)
+        sheet.append(fields)
+        for row in rows(data):
+            sheet.append([row.get(field) for field in fields])
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+# Format -> (etikett, generator, filändelse, MIME-typ)
+FORMATS = {
+    'json': ("JSON", iter_json, 'json', 'application/json'),
+    'ndjson': ("NDJSON (en post per rad)", iter_ndjson, 'ndjson', 'application/x-ndjson'),
+    'csv-activities': ("CSV – aktiviteter", lambda d: iter_csv(d, 'activities'), 'csv', 'text/csv'),
+    'csv-checklists': ("CSV – checklistor", lambda d: iter_csv(d, 'checklists'), 'csv', 'text/csv'),
+    'csv-steps': ("CSV – implementeringssteg", lambda d: iter_csv(d, 'step_progress'), 'csv', 'text/csv'),
+    'csv-organisation': ("CSV – organisation", lambda d: iter_csv(d, 'organisation_info'), 'csv', 'text/csv'),
+    'xlsx': ("Excel (XLSX)", iter_xlsx,
+             'xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+def iter_export(data, fmt):
+    """Exportera planen i valt format som en ström av bytes"""
+    for chunk in FORMATS[fmt][1](data):
+        yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+
+def write_export(data, fmt, f):
+    """Skriv exporten bit för bit till en binär fil, t.ex. en temporärfil"""
+    for chunk in iter_export(data, fmt):
+        f.write(chunk)
+    f.flush()
+
+
+if __name__ == "__main__":
+    from storage import get_storage
+
+    if len(sys.argv) < 2 or sys.argv[1] not in FORMATS:
+        print(f"Användning: python export.py {{{'|'.join(FORMATS)}}} [arbetsyta] > fil")
+        sys.exit(1)
+    plan = get_storage(sys.argv[2] if len(sys.argv) > 2 else 'default').load_shared()
+    for piece in iter_export(plan, sys.argv[1]):
+        sys.stdout.buffer.write(piece)
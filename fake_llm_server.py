@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Lokal stand-in för språkmodellen, för tester och lasttester utan nätverk.
+# Servern svarar på POST /generate från llm_backends.LocalBackend
+# (ISO_AI_BACKEND=local) med påhittad men deterministisk text. Beteendet
+# ställs in med ISO_FAKE_LLM_* nedan, eller argument till create_server.
+LATENCY = float(os.getenv('ISO_FAKE_LLM_LATENCY', '0.2'))
+TPS = float(os.getenv('ISO_FAKE_LLM_TPS', '100'))
+TOKENS = int(os.getenv('ISO_FAKE_LLM_TOKENS', '200'))
+ERROR_RATE = float(os.getenv('ISO_FAKE_LLM_ERROR_RATE', '0'))
+ERROR_STATUS = int(os.getenv('ISO_FAKE_LLM_ERROR_STATUS', '503'))
+CHUNK_TOKENS = int(os.getenv('ISO_FAKE_LLM_CHUNK_TOKENS', '8'))
+
+WORDS = ('informationssäkerhet', 'risk', 'åtgärd', 'ledningen', 'policy', 'kontroll',
+         'tillgång', 'ansvar', 'granskning', 'dokumentation', 'incident', 'leverantör',
+         'behörighet', 'utbildning', 'kontinuitet', 'mål', 'och', 'för', 'att', 'med')
+
+
+class FakeSettings:
+    """Hur den lokala servern beter sig
+
+    latency är sekunder innan första token, tps tokens per sekund därefter
+    (0 = direkt) och tokens svarets längd, som kortas till
+    max_output_tokens om förfrågan anger det. Andelen error_rate av
+    anropen får HTTP-status error_status (t.ex. 429 eller 503). Strömmade
+    svar skickas i bitar om chunk_tokens tokens.
+    """
+
+    def __init__(self, latency=LATENCY, tps=TPS, tokens=TOKENS, error_rate=ERROR_RATE,
+                 error_status=ERROR_STATUS, chunk_tokens=CHUNK_TOKENS, seed=None):
+        self.latency = latency
+        self.tps = tps
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def fail(self):
+        with self._lock:
+            self.requests += 1
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+
+def fake_text(request, tokens):
+    """Deterministiska ord utifrån förfrågan, ett ord per token"""
+    digest = hashlib.sha256(json.dumps(request, sort_keys=True).encode('utf-8')).digest()
+    rng = random.Random(digest)
+    return [rng.choice(WORDS) + ' ' for _ in range(tokens)]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    settings = FakeSettings()
+
+    def do_POST(self):
+        if self.path != '/generate':
+            return self._reply(404, {'error': 'Okänd sökväg'})
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        settings = self.settings
+        time.sleep(settings.latency)
+        if settings.fail():
+            return self._reply(settings.error_status, {'error': 'Simulerat fel från fake_llm_server'})
+
+        config = request.get('generation_config') or {}
+        tokens = min(settings.tokens, config.get('max_output_tokens') or settings.tokens)
+        words = fake_text(request, tokens)
+        if not request.get('stream'):
+            if settings.tps:
+                time.sleep(tokens / settings.tps)
+            return self._reply(200, {'text': ''.join(words)})
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for start in range(0, len(words), settings.chunk_tokens):
+            chunk = words[start:start + settings.chunk_tokens]
+            if settings.tps and start:
+                time.sleep(len(chunk) / settings.tps)
+            self._write_chunk(json.dumps({'text': ''.join(chunk)}, ensure_ascii=False) + '\n')
+        self._write_chunk('')
+
+    def _reply(self, status, body):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(port=8765, host='127.0.0.1', **settings):
+    """En ThreadingHTTPServer med egna inställningar (se FakeSettings); port 0 väljer en ledig"""
+    handler = type('Handler', (FakeLLMHandler,), {'settings': FakeSettings(**settings)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve_in_thread(port=0, **settings):
+    """Starta servern i en bakgrundstråd; returnerar servern (url i server.url)"""
+    server = create_server(port, **settings)
+    server.url = f"http://{server.server_address[0]}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    server = create_server(port)
+    settings = server.RequestHandlerClass.settings
+    print(f"Fake LLM på http://127.0.0.1:{port} (ISO_AI_BACKEND=local): {settings.latency} s latens, "
+          f"{settings.tps} tokens/s, {settings.tokens} tokens, {settings.error_rate:.0%} fel "
+          f"({settings.error_status})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
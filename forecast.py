@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+from datetime import date, timedelta
+from functools import lru_cache
+
+import numpy as np
+
+from scheduler import Scheduler, deadline_days, plan_nodes
+
+SIMULATIONS = int(os.getenv('ISO_FORECAST_SIMULATIONS', '100000'))
+
+# Tak för antal dragningar (öppna noder × simuleringar) per prognos, så att
+# stora planer körs med färre simuleringar men aldrig färre än MIN_SIMULATIONS
+DRAW_BUDGET = int(os.getenv('ISO_FORECAST_DRAWS', '10000000'))
+MIN_SIMULATIONS = int(os.getenv('ISO_FORECAST_MIN_SIMULATIONS', '5000'))
+
+# Uppskattningar är oftare för korta än för långa: varje längd d dras från
+# en triangelfördelning mellan LOW_FACTOR*d och HIGH_FACTOR*d med toppen i d
+LOW_FACTOR = 0.8
+HIGH_FACTOR = 1.6
+
+# Ungefärligt minnestak för en simuleringsomgång; fler simuleringar körs i omgångar
+MEMORY_BUDGET = 256 * 1024 * 1024
+
+
+# Antal kvantiler i tabellen som dragningarna slås upp i
+QUANTILES = 4096
+
+
+def _quantile_table(low, high):
+    # Kvantilerna för en triangelfördelning (low, 1, high) vid mittpunkterna
+    u = (np.arange(QUANTILES, dtype=np.float64) + 0.5) / QUANTILES
+    peak = (1 - low) / (high - low)
+    left = low + np.sqrt(u * (high - low) * (1 - low))
+    right = high - np.sqrt((1 - u) * (high - low) * (high - 1))
+    return np.where(u < peak, left, right).astype(np.float32)
+
+
+def simulate(nodes, simulations=SIMULATIONS, seed=0, low=LOW_FACTOR, high=HIGH_FACTOR):
+    """Simulerade längder (dagar från start) för hela planen, en per simulering
+
+    nodes har samma form som i scheduler.Scheduler. Alla simuleringar körs
+    samtidigt: noderna tas nivå för nivå i beroendegrafen och varje nivå
+    beräknas som en matrisoperation över alla simuleringar.
+    """
+    graph = Scheduler(nodes)
+    n = len(graph.ids)
+    if n == 0:
+        return np.zeros(simulations, dtype=np.float32)
+
+    depth = [0] * n
+    for i in graph.order:
+        depth[i] = max((depth[p] + 1 for p in graph.preds[i]), default=0)
+    levels = [[] for _ in range(max(depth) + 1)]
+    for i, d in enumerate(depth):
+        levels[d].append(i)
+    levels = [np.array(level) for level in levels]
+
+    # Föregångare per nod, utfyllda med index n (en rad med nollor)
+    max_preds = max(1, max(len(p) for p in graph.preds))
+    pred_matrix = np.full((n, max_preds), n)
+    for i, preds in enumerate(graph.preds):
+        pred_matrix[i, :len(preds)] = preds
+
+    # Alla längder har samma fördelning skalad med d: slå upp dragningarna i en tabell
+    duration = np.array(graph.duration, dtype=np.float32)
+    table = _quantile_table(low, high)
+    widest = max(len(level) for level in levels)
+    chunk = max(1, min(simulations, MEMORY_BUDGET // (4 * (n + 1 + widest * (max_preds + 3)))))
+
+    rng = np.random.default_rng(seed)
+    ends = np.empty(simulations, dtype=np.float32)
+    for first in range(0, simulations, chunk):
+        size = min(chunk, simulations - first)
+        finish = np.zeros((n + 1, size), dtype=np.float32)
+        for index, level in enumerate(levels):
+            # Avklarade noder (längd 0) behöver inga dragningar
+            open_nodes = level[duration[level] > 0]
+            if index:
+                finish[level] = finish[pred_matrix[level]].max(axis=1)
+            if len(open_nodes):
+                draws = table[rng.integers(0, QUANTILES, (len(open_nodes), size), dtype=np.int16)]
+                draws *= duration[open_nodes, None]
+                finish[open_nodes] += draws
+        ends[first:first + size] = finish[:n].max(axis=0)
+    return ends
+
+
+@lru_cache(maxsize=32)
+def _forecast(nodes, deadline, simulations, seed):
+    start = time.perf_counter()
+    ends = simulate(nodes, simulations, seed)
+    p50, p90 = np.percentile(ends, [50, 90])
+    return {
+        'probability': float(np.mean(ends <= deadline)) if deadline is not None else None,
+        'p50': float(p50),
+        'p90': float(p90),
+        'mean': float(ends.mean()),
+        'simulations': simulations,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def simulation_count(nodes, simulations=SIMULATIONS, budget=DRAW_BUDGET):
+    """Antal simuleringar för nodes inom budget dragningar (högst simulations)"""
+    open_nodes = sum(1 for _, duration, _ in nodes if duration > 0)
+    return min(simulations, max(MIN_SIMULATIONS, budget // max(1, open_nodes)))
+
+
+def forecast(nodes, deadline=None, simulations=SIMULATIONS, seed=0):
+    """Sannolikhet att bli klar inom deadline (dagar) samt P50/P90 i dagar
+
+    Resultatet cachas per uppsättning noder, längder och deadline, så det
+    räknas bara om när framsteg, uppskattningar eller datum ändras. Stora
+    planer simuleras färre gånger (se simulation_count), så att en omräkning
+    håller sig under en halv sekund; resultatets simulations anger antalet
+    som faktiskt kördes och requested det begärda.
+    """
+    key = tuple((node_id, duration, tuple(deps)) for node_id, duration, deps in nodes)
+    return {**_forecast(key, deadline, simulation_count(nodes, simulations), seed), 'requested': simulations}
+
+
+def benchmark(n=1000, simulations=SIMULATIONS):
+    """Mät simuleringstiden för planens steg plus n aktiviteter"""
+    from implementation_steps import IMPLEMENTATION_STEPS
+
+    activities = [{'id': f'a{i}', 'status': 'Ej påbörjad', 'duration': f'{i % 5 + 1} dagar',
+                   'depends_on': [f'a{i - 1}'] if i % 10 else [f'step:{i % 9 + 1}']}
+                  for i in range(n)]
+    for count in (0, n):
+        nodes = plan_nodes(IMPLEMENTATION_STEPS, {}, activities[:count])
+        result = forecast(nodes, deadline=200, simulations=simulations)
+        cached = time.perf_counter()
+        forecast(nodes, deadline=200, simulations=simulations)
+        cached = time.perf_counter() - cached
+        print(f"{len(nodes)} noder, {result['simulations']} simuleringar: {result['seconds'] * 1000:.0f} ms "
+              f"(cachat {cached * 1000:.2f} ms), P50 {result['p50']:.0f} / P90 {result['p90']:.0f} dagar, "
+              f"klart inom 200 dagar {result['probability']:.0%}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
+    else:
+        from implementation_steps import IMPLEMENTATION_STEPS
+        from storage import get_storage
+
+        plan = get_storage(sys.argv[1] if len(sys.argv) > 1 else 'default').load_shared()
+        today = date.today()
+        target = plan.get('organisation_info', {}).get('target_date')
+        result = forecast(
+            plan_nodes(IMPLEMENTATION_STEPS, plan.get('step_progress', {}), plan.get('activities', [])),
+            deadline_days(target, today))
+        print(f"P50: {today + timedelta(days=result['p50'])}  P90: {today + timedelta(days=result['p90'])}")
+        print(f"{result['simulations']:,} av {result['requested']:,} begärda simuleringar")
+        if result['probability'] is not None:
+            print(f"Sannolikhet att bli klar till {target}: {result['probability']:.0%}")
@@ -0,0 +1,142 @@
+import hashlib
+import io
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+# Längsta sida i pixlar som skickas till bildmodellen; större bilder skalas
+# ändå ned av tjänsten, så fler pixlar ger bara längre uppladdning
+MAX_SIDE = int(os.getenv('ISO_VISION_MAX_SIDE', '1536'))
+JPEG_QUALITY = int(os.getenv('ISO_VISION_QUALITY', '85'))
+
+# Antal förbehandlade bilder som hålls i minnet, nycklade på innehållets hash
+CACHE_SIZE = int(os.getenv('ISO_VISION_CACHE_SIZE', '32'))
+
+# Uppladdningshastighet (Mbit/s) som den sparade tiden uppskattas med
+UPLINK_MBPS = float(os.getenv('ISO_VISION_UPLINK_MBPS', '10'))
+
+
+class PreparedImage:
+    """En bild förbehandlad för bildmodellen
+
+    data är de omkodade bytes som skickas (utan metadata) och image samma
+    bild som PIL-bild för visning. blob() ger delen som skickas till
+    modellen, så att biblioteket inte kodar om bilden en gång till.
+    """
+
+    def __init__(self, image, data, mime_type, original_bytes, original_size, seconds):
+        self.image = image
+        self.data = data
+        self.mime_type = mime_type
+        self.original_bytes = original_bytes
+        self.original_size = original_size
+        self.seconds = seconds
+
+    @property
+    def saved_bytes(self):
+        return self.original_bytes - len(self.data)
+
+    def upload_seconds(self, size, mbps=UPLINK_MBPS):
+        return size * 8 / (mbps * 1_000_000)
+
+    def blob(self):
+        return {'mime_type': self.mime_type, 'data': self.data}
+
+    def report(self):
+        """Sammanfattning av förbehandlingen som text"""
+        saved = self.upload_seconds(self.original_bytes) - self.upload_seconds(len(self.data))
+        change = abs(self.saved_bytes) / max(1, self.original_bytes)
+        return (f"{self.original_size[0]}×{self.original_size[1]} px, {self.original_bytes / 1e6:.2f} MB → "
+                f"{self.image.size[0]}×{self.image.size[1]} px, {len(self.data) / 1e6:.2f} MB "
+                f"({change:.0%} {'mindre' if self.saved_bytes >= 0 else 'större'}). Förbehandling "
+                f"{self.seconds * 1000:.0f} ms, ~{abs(saved):.1f} s {'kortare' if saved >= 0 else 'längre'} "
+                f"uppladdning vid {UPLINK_MBPS:g} Mbit/s")
+
+
+def _encode(image, format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+
+def _stripped(image):
+    """Kopia i samma läge (t.ex. med palett) utan metadata utom genomskinlighet"""
+    stripped = image.copy()
+    stripped.info = {k: v for k, v in image.info.items() if k == 'transparency'}
+    return stripped
+
+
+def prepare_image(data, max_side=MAX_SIDE, quality=JPEG_QUALITY):
+    """Skala ned, rotera enligt EXIF, ta bort metadata och koda om en bild
+
+    Foton kodas som JPEG. Bilder med få färger eller genomskinlighet, som
+    skärmbilder och diagram, kodas också som PNG och det minsta formatet
+    används.
+    """
+    start = time.perf_counter()
+    with Image.open(io.BytesIO(data)) as source:
+        original_size = source.size
+        lossless = source.format == 'PNG' or source.mode in ('1', 'P')
+        # JPEG kan avkodas direkt i lägre upplösning, vilket går mycket fortare för stora foton
+        source.draft('RGB', (max_side, max_side))
+        full = ImageOps.exif_transpose(source)
+    original = full
+    alpha = full.mode in ('RGBA', 'LA', 'PA') or 'transparency' in full.info
+    full = full.convert('RGBA' if alpha else 'RGB')
+    # Utan info följer ingen EXIF, GPS-position, ICC-profil eller annan metadata med
+    full.info = {}
+    image = full.copy()
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    if alpha:
+        opaque = Image.new('RGB', image.size, 'white')
+        opaque.paste(image, mask=image.getchannel('A'))
+    else:
+        opaque = image
+    candidates = [(_encode(opaque, 'JPEG', quality=quality, optimize=True), 'image/jpeg', opaque)]
+    if lossless or alpha:
+        candidates.append((_encode(image, 'PNG', optimize=True), 'image/png', image))
+        if min(len(c[0]) for c in candidates) > len(data):
+            # Enkla diagram packas ofta bättre i full upplösning än nedskalade med kantutjämning
+            candidates.append((_encode(full, 'PNG', optimize=True), 'image/png', full))
+            if original.mode != full.mode:
+                # Palett- och gråskalebilder blir ofta större i RGB: behåll ursprungligt läge
+                stripped = _stripped(original)
+                candidates.append((_encode(stripped, 'PNG', optimize=True), 'image/png', stripped))
+    encoded, mime_type, image = min(candidates, key=lambda c: len(c[0]))
+    return PreparedImage(image, encoded, mime_type, len(data), original_size, time.perf_counter() - start)
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def prepared(data):
+    """prepare_image med en processgemensam cache nycklad på innehållets sha256
+
+    Samma uppladdade bild förbehandlas därmed bara en gång, även över
+    omladdningar och sessioner.
+    """
+    key = hashlib.sha256(data).hexdigest()
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    result = prepare_image(data)
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Användning: python image_prep.py bild [bild ...]")
+    for path in sys.argv[1:]:
+        with open(path, 'rb') as f:
+            print(f"{path}: {prepare_image(f.read()).report()}")
@@ -0,0 +1,103 @@
+# Implementeringsstegen för ISO 27001 med beskrivning, uppskattad tid och leverabler
+IMPLEMENTATION_STEPS = {
+    "1. Samla ditt team": {
+        "description": """
+        - Identifiera nyckelpersoner från olika avdelningar (IT, HR, juridik, kvalitet)
+        - Definiera roller och ansvar
+        - Skapa en RACI-matris
+        """,
+        "estimated_time": "1 vecka",
+        "deliverables": "Projekt RACI-matris, utkast till Statement of Applicability och Scope"
+    },
+    "2. Gap-analys": {
+        "description": """
+        - Utvärdera nuvarande säkerhetsstatus
+        - Identifiera gap mot ISO 27001-standarden
+        - Dokumentera resultat och rekommendationer
+        """,
+        "estimated_time": "2 veckor",
+        "deliverables": "Gap-analysrapport med identifierade risker och brister"
+    },
+    "3. Prioritera åtgärder": {
+        "description": """
+        - Analysera gap-analysens resultat
+        - Prioritera åtgärder baserat på risk och resurser
+        - Skapa handlingsplan
+        """,
+        "estimated_time": "6 veckor",
+        "deliverables": "Prioriterad åtgärdsplan med tidslinjer"
+    },
+    "4. Tillgångshantering": {
+        "description": """
+        - Identifiera informationstillgångar
+        - Klassificera tillgångar efter känslighet
+        - Upprätta tillgångsregister
+        """,
+        "estimated_time": "2 veckor",
+        "deliverables": "Uppdaterat tillgångsregister"
+    },
+    "5. Riskhantering": {
+        "description": """
+        - Genomför riskbedömning
+        - Identifiera och värdera hot
+        - Utveckla riskreducerande åtgärder
+        """,
+        "estimated_time": "2 veckor",
+        "deliverables": "Riskbedömning och åtgärdsplan"
+    },
+    "6. ISMS-dokumentation": {
+        "description": """
+        - Utveckla policyer och procedurer
+        - Skapa rutiner och arbetsinstruktioner
+        - Dokumentera säkerhetskontroller
+        """,
+        "estimated_time": "6 veckor",
+        "deliverables": "Komplett ISMS-dokumentation"
+    },
+    "7. Intern revision": {
+        "description": """
+        - Planera intern revision
+        - Genomför revision av ISMS
+        - Dokumentera resultat och avvikelser
+        """,
+        "estimated_time": "2 veckor",
+        "deliverables": "Intern revisionsrapport"
+    },
+    "8. Ledningens genomgång": {
+        "description": """
+        - Presentera resultat för ledningen
+        - Utvärdera ISMS effektivitet
+        - Besluta om förbättringsåtgärder
+        """,
+        "estimated_time": "2 veckor",
+        "deliverables": "Protokoll från ledningens genomgång"
+    },
+    "9. Extern revision och certifiering": {
+        "description": """
+        - Välj certifieringsorgan
+        - Genomgå steg 1-revision
+        - Genomgå steg 2-revision (platsbesök)
+        """,
+        "estimated_time": "2 veckor",
+        "deliverables": "ISO 27001-certifiering"
+    }
+}
+
+
+def step_prompt(step, details):
+    """Prompt för AI-rekommendationer till ett implementeringssteg"""
+    return f"""
+    Ge konkreta rekommendationer för följande steg i ISO 27001-implementationen:
+
+    Steg: {step}
+    Beskrivning: {details['description']}
+    Förväntade leverabler: {details['deliverables']}
+
+    Ge specifika, praktiska råd om:
+    1. Hur man bäst genomför detta steg
+    2. Vanliga fallgropar att undvika
+    3. Viktiga framgångsfaktorer
+    4. Konkreta exempel på best practices
+
+    Svara på svenska och var mycket specifik.
+    """
@@ -0,0 +1,20 @@
+import math
+
+
+def percentile(values, p):
+    """p:e percentilen (0–100) av values med linjär interpolation; 0.0 för en tom lista"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = (len(ordered) - 1) * p / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values, points=(50, 90, 95, 99)):
+    """Antal, medel, max och percentiler för en lista med tider i sekunder"""
+    ordered = sorted(values)
+    summary = {'count': len(ordered), 'mean': sum(ordered) / len(ordered) if ordered else 0.0,
+               'max': ordered[-1] if ordered else 0.0}
+    summary.update({f'p{p}': percentile(ordered, p) for p in points})
+    return summary
@@ -0,0 +1,218 @@
+import http.client
+import itertools
+import json
+import os
+import socket
+import threading
+from urllib.parse import urlsplit
+
+import google.generativeai as genai
+from google.api_core import exceptions as api_exceptions
+from google.generativeai import client as genai_client
+
+from ai_cache import normalize
+
+# Antal klienter (egna anslutningar) som delas av alla sessioner, och
+# timeout i sekunder för varje anrop
+POOL_SIZE = int(os.getenv('ISO_AI_POOL_SIZE', '4'))
+TIMEOUT = float(os.getenv('ISO_AI_TIMEOUT', '60'))
+
+LOCAL_URL = 'http://127.0.0.1:8765'
+
+
+class LLMBackend:
+    """Gränssnitt mot en språkmodell
+
+    generate ger hela svaret som text. stream ger texten i bitar; själva
+    anropet (och därmed eventuella fel) ska ske innan stream returnerar,
+    så att anropet kan försökas igen innan något har visats. Fel rapporteras
+    med undantagen i google.api_core.exceptions, oavsett backend.
+    """
+
+    name = None
+
+    def generate(self, model, contents, generation_config=None):
+        raise NotImplementedError
+
+    def stream(self, model, contents, generation_config=None):
+        raise NotImplementedError
+
+
+class _TimeoutClient:
+    """GenerativeServiceClient med timeout på varje anrop
+
+    google-generativeai 0.3.2 saknar request_options, så timeouten läggs på
+    direkt i anropen till den underliggande klienten.
+    """
+
+    def __init__(self, client, timeout):
+        self._client = client
+        self.timeout = timeout
+
+    def generate_content(self, request, **kwargs):
+        return self._client.generate_content(request, timeout=self.timeout, **kwargs)
+
+    def stream_generate_content(self, request, **kwargs):
+        return self._client.stream_generate_content(request, timeout=self.timeout, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class ClientPool:
+    """Ett fast antal Gemini-klienter som skapas vid första användning
+
+    Klienterna och deras anslutningar återanvänds mellan omladdningar och
+    sessioner; anropen fördelas på dem i tur och ordning.
+    """
+
+    def __init__(self, size=POOL_SIZE, timeout=TIMEOUT):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._clients = [None] * self.size
+        self._models = {}
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    def _client(self, slot):
+        if self._clients[slot] is None:
+            self._clients[slot] = _TimeoutClient(
+                genai_client._client_manager.make_client('generative'), self.timeout)
+        return self._clients[slot]
+
+    def model(self, name):
+        """En GenerativeModel för name, bunden till nästa klient i poolen"""
+        slot = next(self._turn) % self.size
+        with self._lock:
+            model = self._models.get((name, slot))
+            if model is None:
+                model = genai.GenerativeModel(name)
+                # Modellen skapar annars sin egen klient vid första anropet
+                model._client = self._client(slot)
+                self._models[name, slot] = model
+            return model
+
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini via google-generativeai och en delad klientpool"""
+
+    name = 'gemini'
+
+    def __init__(self, pool_size=POOL_SIZE, timeout=TIMEOUT):
+        self.pool = ClientPool(pool_size, timeout)
+
+    def generate(self, model, contents, generation_config=None):
+        return self.pool.model(model).generate_content(contents, generation_config=generation_config).text
+
+    def stream(self, model, contents, generation_config=None):
+        # generate_content hämtar första biten direkt, så fel uppstår här
+        response = self.pool.model(model).generate_content(
+            contents, generation_config=generation_config, stream=True)
+        return (chunk.text for chunk in response)
+
+
+class LocalBackend(LLMBackend):
+    """Lokal HTTP-server med samma gränssnitt, t.ex. fake_llm_server.py
+
+    Förfrågan skickas som JSON till POST /generate; bilder ersätts av sin
+    hash. Strömmade svar kommer som en JSON-rad per bit. HTTP-fel översätts
+    till samma undantag som Gemini ger, så återförsök och brytare fungerar
+    likadant. Anslutningarna hålls öppna och återanvänds mellan anropen,
+    oavsett vilken tråd som gör dem.
+    """
+
+    name = 'local'
+
+    def __init__(self, url=LOCAL_URL, timeout=TIMEOUT):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connection(self, reuse=True):
+        if reuse:
+            with self._lock:
+                if self._idle:
+                    return self._idle.pop()
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _release(self, conn):
+        """Lämna tillbaka en anslutning vars svar har lästs färdigt"""
+        with self._lock:
+            self._idle.append(conn)
+
+    def _timeout_error(self, error):
+        return api_exceptions.DeadlineExceeded(f"Ingen svar inom {self.timeout:.0f} s")
+
+    def _request(self, body):
+        """(anslutning, svar) för en förfrågan; anslutningen lämnas tillbaka av anroparen"""
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        for attempt in range(2):
+            # Servern kan ha stängt en gammal anslutning; andra försöket görs med en ny
+            conn = self._connection(reuse=not attempt)
+            try:
+                conn.request('POST', '/generate', payload, {'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                break
+            except socket.timeout as e:
+                conn.close()
+                raise self._timeout_error(e) from e
+            except (ConnectionError, http.client.HTTPException) as e:
+                conn.close()
+                if attempt:
+                    raise api_exceptions.ServiceUnavailable(f"Kunde inte nå {self.host}:{self.port}: {e}") from e
+        if response.status != 200:
+            message = response.read().decode('utf-8', 'replace')
+            self._release(conn)
+            raise api_exceptions.from_http_status(response.status, message)
+        return conn, response
+
+    def _body(self, model, contents, generation_config, stream):
+        return {'model': model, 'contents': normalize(contents),
+                'generation_config': normalize(generation_config), 'stream': stream}
+
+    def generate(self, model, contents, generation_config=None):
+        conn, response = self._request(self._body(model, contents, generation_config, False))
+        try:
+            text = json.loads(response.read())['text']
+        except socket.timeout as e:
+            conn.close()
+            raise self._timeout_error(e) from e
+        self._release(conn)
+        return text
+
+    def stream(self, model, contents, generation_config=None):
+        conn, response = self._request(self._body(model, contents, generation_config, True))
+        try:
+            first = response.readline()
+        except socket.timeout as e:
+            conn.close()
+            raise self._timeout_error(e) from e
+        return self._chunks(conn, response, first)
+
+    def _chunks(self, conn, response, line):
+        try:
+            while line:
+                message = json.loads(line)
+                if 'error' in message:
+                    raise api_exceptions.from_http_status(message.get('status', 500), message['error'])
+                yield message['text']
+                line = response.readline()
+        except BaseException:
+            # Även när läsaren slutar i förtid: resten av svaret är oläst
+            conn.close()
+            raise
+        response.read()
+        self._release(conn)
+
+
+def create_backend(kind=None):
+    """Backend enligt ISO_AI_BACKEND: gemini (standard) eller local (ISO_AI_LOCAL_URL)"""
+    kind = (kind or os.getenv('ISO_AI_BACKEND', 'gemini')).lower()
+    if kind == 'gemini':
+        return GeminiBackend(POOL_SIZE, TIMEOUT)
+    if kind == 'local':
+        return LocalBackend(os.getenv('ISO_AI_LOCAL_URL', LOCAL_URL), TIMEOUT)
+    raise ValueError(f"Okänd AI-backend: {kind}")
@@ -1,24 +1,25 @@
 import os
+import json
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
-import google.generativeai as genai
+import ai
+from latency_stats import summarize
 
 # Ladda miljövariabler från .env filen
 load_dotenv()
 
 # Konfigurera Gemini API med din API-nyckel
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-genai.configure(api_key=GOOGLE_API_KEY)
-
-# Välj Gemini Pro-modellen
-model = genai.GenerativeModel('gemini-pro')
+ai.configure(GOOGLE_API_KEY)
 
 def get_gemini_response(prompt):
     """Skicka en förfrågan till Gemini API och få ett svar"""
     try:
-        response = model.generate_content(prompt)
-        return response.text
+        return ai.generate(prompt, label='cli')
     except Exception as e:
-        return f"Ett fel uppstod: {str(e)}"
+        return f"Ett fel uppstod: {ai.describe_error(e)}"
 
 def main():
     print("Välkommen till Gemini API Test App!")
@@ -34,8 +35,152 @@ def main():
         response = get_gemini_response(user_input)
         print("\nGemini svarar:", response)
 
+def read_prompts(lines):
+    """Förfrågningar ur JSONL: {"prompt": ..., valfritt "id", "model", "generation_config"}
+
+    En rad som inte går att tolka ger {"line": n, "error": ...} i stället,
+    så att resten av filen ändå körs.
+    """
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield {'line': number, 'error': f"Ogiltig JSON: {e}"}
+            continue
+        if isinstance(record, str):
+            record = {'prompt': record}
+        if not isinstance(record, dict) or not isinstance(record.get('prompt'), str):
+            yield {'line': number, 'error': 'Raden saknar en "prompt" med text'}
+            continue
+        record.setdefault('id', number)
+        yield record
+
+
+def completed_ids(path):
+    """Id:n som redan har ett svar i en tidigare utdatafil (checkpoint)"""
+    done = set()
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # t.ex. en halvskriven sista rad efter ett avbrott
+                if 'response' in record:
+                    done.add(record['id'])
+    return done
+
+
+def run_prompt(record):
+    """Kör en förfrågan och returnera raden som ska skrivas ut"""
+    result = {k: v for k, v in record.items() if k != 'prompt'}
+    start = time.perf_counter()
+    try:
+        result['response'] = ai.generate(record['prompt'], model=record.get('model', ai.DEFAULT_MODEL),
+                                         generation_config=record.get('generation_config'), label='batch')
+    except Exception as e:
+        result['error'] = ai.describe_error(e)
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run_batch(records, output, concurrency=ai.CONCURRENCY, skip=()):
+    """Kör förfrågningarna med högst concurrency samtidiga anrop
+
+    Varje svar skrivs som en JSON-rad till output så snart det är klart, så
+    att en avbruten körning kan återupptas: rader med id i skip hoppas
+    över. Returnerar statistik över körningen.
+    """
+    latencies, errors, skipped = [], [], 0
+    pending = set()
+    interrupted = False
+
+    def emit(result):
+        output.write(json.dumps(result, ensure_ascii=False) + '\n')
+        output.flush()
+        if 'error' in result:
+            errors.append(result.get('id', result.get('line')))
+
+    def write(futures):
+        for future in futures:
+            pending.discard(future)
+            result = future.result()
+            emit(result)
+            latencies.append(result['seconds'])
+
+    start = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch')
+    try:
+        for record in records:
+            if 'prompt' not in record:
+                emit(record)  # rad som inte gick att tolka
+                continue
+            if record['id'] in skip:
+                skipped += 1
+                continue
+            # Läs bara in så många förfrågningar som kan köras, även från en stor fil eller stdin
+            if len(pending) >= 2 * concurrency:
+                write(wait(pending, return_when=FIRST_COMPLETED).done)
+            pending.add(pool.submit(run_prompt, record))
+        write(wait(pending).done)
+    except KeyboardInterrupt:
+        interrupted = True
+        print("\nAvbrutet; kör samma kommando igen för att fortsätta.", file=sys.stderr)
+        try:
+            # Anrop som redan startat skrivs ut innan körningen avslutas; ett andra avbrott väntar inte
+            write(wait({future for future in pending if not future.cancel()}).done)
+        except KeyboardInterrupt:
+            pass
+    except Exception:
+        # Oväntat fel: skriv ut svaren som redan skickats iväg innan felet lyfts vidare
+        write(wait(pending).done)
+        raise
+    finally:
+        pool.shutdown(wait=False, cancel_futures=interrupted)
+    elapsed = time.perf_counter() - start
+    return {'completed': len(latencies), 'failures': len(errors), 'skipped': skipped, 'seconds': elapsed,
+            'throughput': len(latencies) / elapsed if elapsed else 0.0, 'latency': summarize(latencies)}
+
+
+def batch(args):
+    """python main.py batch [indata.jsonl|-] [utdata.jsonl] [--concurrency N]
+
+    Utan utdatafil skrivs svaren till stdout. Med en utdatafil läggs nya
+    svar till i den, och förfrågningar som redan har ett svar där hoppas
+    över, så att ett avbrott kan återupptas. Sammanfattningen skrivs till stderr.
+    """
+    concurrency = ai.CONCURRENCY
+    if '--concurrency' in args:
+        position = args.index('--concurrency')
+        concurrency = int(args[position + 1])
+        del args[position:position + 2]
+    source = args[0] if args else '-'
+    target = args[1] if len(args) > 1 else None
+
+    skip = completed_ids(target)
+    lines = sys.stdin if source == '-' else open(source, encoding='utf-8')
+    output = open(target, 'a', encoding='utf-8') if target else sys.stdout
+    try:
+        stats = run_batch(read_prompts(lines), output, max(1, concurrency), skip)
+    finally:
+        if target:
+            output.close()
+        if lines is not sys.stdin:
+            lines.close()
+
+    latency = stats['latency']
+    print(f"{stats['completed']} förfrågningar på {stats['seconds']:.1f} s ({stats['throughput']:.2f}/s), "
+          f"{stats['failures']} misslyckade, {stats['skipped']} redan klara", file=sys.stderr)
+    print(f"Latens: p50 {latency['p50']:.2f} s, p90 {latency['p90']:.2f} s, p99 {latency['p99']:.2f} s, "
+          f"max {latency['max']:.2f} s", file=sys.stderr)
+    return 1 if stats['failures'] else 0
+
 if __name__ == "__main__":
-    if not GOOGLE_API_KEY:
+    if not GOOGLE_API_KEY and ai.requires_api_key():
         print("Varning: Ingen API-nyckel hittades. Skapa en .env fil med din GOOGLE_API_KEY.")
+    elif len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        sys.exit(batch(sys.argv[2:]))
     else:
         main()
@@ -1,27 +1,124 @@
 import os
+import json
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-import google.generativeai as genai
+import ai
+from latency_stats import summarize
 
 # Ladda miljövariabler
 load_dotenv()
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-genai.configure(api_key=GOOGLE_API_KEY)
+ai.configure(GOOGLE_API_KEY)
+
+PING_PROMPT = 'Ping test: Svara "OK" om du får detta meddelande.'
+
+# Percentiler som rapporteras i benchmarkläget
+PERCENTILES = (50, 95, 99)
 
 def test_api_connection():
     try:
-        # Skapa en modell-instans
-        model = genai.GenerativeModel('gemini-pro')
-        
-        # Skicka ett ping-meddelande
-        response = model.generate_content('Ping test: Svara "OK" om du får detta meddelande.')
+        # Skicka ett ping-meddelande, förbi cachen så att API:et (eller den
+        # lokala servern med ISO_AI_BACKEND=local) faktiskt anropas
+        response = ai.generate(PING_PROMPT, cache=False, label='ping')
         
         # Skriv ut svaret
-        print("\n✅ API-anslutning lyckades!")
-        print(f"Svar från API: {response.text}\n")
+        print(f"\n✅ API-anslutning lyckades! ({ai.BACKEND})")
+        print(f"Svar från API: {response}\n")
         
     except Exception as e:
         print(f"\n❌ Kunde inte ansluta till API:et.")
-        print(f"Felmeddelande: {str(e)}\n")
+        print(f"Felmeddelande: {ai.describe_error(e)}\n")
+
+def timed_request(model, streaming):
+    """Ett anrop direkt till backend: total tid, tid till första biten och eventuellt feltyp
+
+    Anropet går förbi cache, kvoter och återförsök i ai.py, så tiden är
+    tjänstens egen latens utan köande eller väntan mellan försök.
+    """
+    backend = ai.get_backend()
+    start = time.perf_counter()
+    first = None
+    try:
+        if streaming:
+            for _ in backend.stream(model, PING_PROMPT):
+                if first is None:
+                    first = time.perf_counter() - start
+        else:
+            backend.generate(model, PING_PROMPT)
+        error = None
+    except Exception as e:
+        error = type(e).__name__
+    return {'seconds': time.perf_counter() - start, 'ttft': first, 'error': error}
+
+def run_phase(pool, requests, model, streaming):
+    """Kör requests anrop i poolen och sammanfatta latens och genomströmning"""
+    start = time.perf_counter()
+    results = list(pool.map(lambda _: timed_request(model, streaming), range(requests)))
+    elapsed = time.perf_counter() - start
+    ok = [r for r in results if r['error'] is None]
+    summary = {
+        'requests': requests,
+        'errors': requests - len(ok),
+        'error_types': dict(Counter(r['error'] for r in results if r['error'])),
+        'seconds': elapsed,
+        'throughput': len(ok) / elapsed if elapsed else 0.0,
+        'latency': summarize([r['seconds'] for r in ok], PERCENTILES),
+    }
+    if streaming:
+        summary['ttft'] = summarize([r['ttft'] for r in ok if r['ttft'] is not None], PERCENTILES)
+    return summary
+
+def benchmark(requests=50, concurrency=5, model=ai.DEFAULT_MODEL, streaming=False):
+    """Mät latens med kalla och varma anslutningar
+
+    Först görs concurrency anrop samtidigt på nya anslutningar (kallstart:
+    anslutning, TLS och första anropet), sedan requests anrop på samma
+    anslutningar. Anropen går direkt till backend (se timed_request), så
+    varken cachen, kvoterna (ISO_AI_RPM/ISO_AI_TPM) eller återförsöken
+    påverkar mätningen; fel räknas per typ i stället för att försökas igen.
+    """
+    ai.reset_backend()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='ping') as pool:
+        cold = run_phase(pool, concurrency, model, streaming)
+        warm = run_phase(pool, requests, model, streaming)
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'backend': ai.BACKEND,
+        'model': model,
+        'stream': streaming,
+        'concurrency': concurrency,
+        'cold': cold,
+        'warm': warm,
+    }
+
+def _option(args, name, default):
+    if name in args:
+        position = args.index(name)
+        value = args[position + 1]
+        del args[position:position + 2]
+        return value
+    return default
 
 if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args and args[0] == 'benchmark':
+        # python ping_test.py benchmark [antal] [--concurrency C] [--model M] [--stream]
+        args = args[1:]
+        streaming = '--stream' in args
+        if streaming:
+            args.remove('--stream')
+        concurrency = int(_option(args, '--concurrency', '5'))
+        model = _option(args, '--model', ai.DEFAULT_MODEL)
+        result = benchmark(int(args[0]) if args else 50, max(1, concurrency), model, streaming)
+        print(json.dumps(result, indent=2))
+        warm = result['warm']
+        print(f"kall p50 {result['cold']['latency']['p50'] * 1000:.0f} ms, varm p50/p95/p99 "
+              f"{warm['latency']['p50'] * 1000:.0f}/{warm['latency']['p95'] * 1000:.0f}/"
+              f"{warm['latency']['p99'] * 1000:.0f} ms, {warm['throughput']:.1f} anrop/s, "
+              f"{warm['errors']} fel", file=sys.stderr)
+        sys.exit(1 if warm['errors'] or result['cold']['errors'] else 0)
     test_api_connection()
@@ -0,0 +1,200 @@
+import os
+import sys
+from collections import Counter
+from datetime import date
+
+import ai
+
+# Max antal tokens i en prompt (uppskattat), och max antal delar som en stor
+# handlingsplan sammanfattas i; standardvärdena ryms i en minuts standardkvot
+# (ISO_AI_TPM). Aktiviteter utöver det räknas bara per status, prioritet och
+# ansvarig.
+PROMPT_TOKENS = int(os.getenv('ISO_AI_PROMPT_TOKENS', '6000'))
+MAX_CHUNKS = int(os.getenv('ISO_AI_MAX_CHUNKS', '4'))
+
+# Längsta aktivitetsrad som tas med i en prompt
+MAX_LINE_CHARS = 300
+
+# Max antal grupper (status, prioritet, ansvarig) för aktiviteter som inte ryms
+ROLLUP_GROUPS = 20
+
+PRIORITY_RANK = {'Hög': 0, 'Medium': 1, 'Låg': 2}
+DONE_STATUS = 'Klar'
+
+
+def count_tokens(text):
+    return ai.estimate_tokens(text)
+
+
+def activity_line(activity):
+    line = (f"- {activity['activity']} (Prioritet: {activity['priority']}, "
+            f"Status: {activity['status']}, Deadline: {activity['due_date']})")
+    return line if len(line) <= MAX_LINE_CHARS else line[:MAX_LINE_CHARS - 1] + '…'
+
+
+def pack(lines, budget):
+    """Dela rader i följd i delar om högst budget tokens vardera"""
+    chunks, current, used = [], [], 0
+    for line in lines:
+        cost = count_tokens(line) + 1
+        if current and used + cost > budget:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(line)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _by_importance(activity):
+    # Öppna aktiviteter först, sedan efter prioritet och deadline
+    return (activity.get('status') == DONE_STATUS,
+            PRIORITY_RANK.get(activity.get('priority'), len(PRIORITY_RANK)),
+            activity.get('due_date') or '')
+
+
+def plan_statistics(activities, today):
+    """Sammanställning av hela handlingsplanen, beräknad lokalt utan AI"""
+    status = Counter(a.get('status') for a in activities)
+    priority = Counter(a.get('priority') for a in activities)
+    overdue = sum(1 for a in activities
+                  if a.get('status') != DONE_STATUS and (a.get('due_date') or '9999') < today.isoformat())
+    return '\n'.join([
+        f"- Totalt {len(activities)} aktiviteter",
+        f"- Per status: {', '.join(f'{k}: {v}' for k, v in status.most_common())}",
+        f"- Per prioritet: {', '.join(f'{k}: {v}' for k, v in priority.most_common())}",
+        f"- Försenade (deadline passerad, ej klara): {overdue}",
+    ])
+
+
+def omitted_rollup(activities, limit=ROLLUP_GROUPS):
+    """Aktiviteter som inte ryms i prompten, räknade per status, prioritet och ansvarig"""
+    groups = {}
+    for a in activities:
+        key = (a.get('status') or 'Ej angiven', a.get('priority') or 'Ej angiven',
+               a.get('responsible') or 'Ingen ansvarig')
+        count, earliest = groups.get(key, (0, None))
+        due = a.get('due_date') or None
+        groups[key] = (count + 1, min(filter(None, (earliest, due)), default=None))
+    ordered = sorted(groups.items(), key=lambda item: -item[1][0])
+    lines = [f"- {status}, {priority}, {responsible}: {count} st"
+             + (f", tidigaste deadline {earliest}" if earliest else '')
+             for (status, priority, responsible), (count, earliest) in ordered[:limit]]
+    rest = sum(count for _, (count, _) in ordered[limit:])
+    if rest:
+        lines.append(f"- Övriga grupper: {rest} st")
+    return '\n'.join(lines)
+
+
+def _plan_prompt(org_info, checklists, activity_section):
+    return f"""
+        Analysera följande handlingsplan för ISO 27001-implementering och ge konkreta rekommendationer:
+
+        Organisationsinformation:
+        - Namn: {org_info.get('org_name', 'Ej angivet')}
+        - Antal anställda: {org_info.get('org_size', 'Ej angivet')}
+        - Målsättning för certifiering: {org_info.get('target_date', 'Ej angivet')}
+
+        Nuvarande aktiviteter i handlingsplanen:
+        {activity_section}
+
+        Checklista status:
+        Ledningens engagemang: {', '.join([k for k, v in checklists.get('ledningens_engagemang', {}).items() if v])}
+        Scope: {', '.join([k for k, v in checklists.get('scope', {}).items() if v])}
+        Riskanalys: {', '.join([k for k, v in checklists.get('riskanalys', {}).items() if v])}
+
+        Baserat på denna information, ge rekommendationer om:
+        1. Saknade kritiska aktiviteter som bör läggas till
+        2. Förslag på omprioritering av befintliga aktiviteter
+        3. Tidslinjejusteringar baserat på best practices
+        4. Specifika åtgärder för att öka effektiviteten
+        5. Risker att vara uppmärksam på
+
+        Svara på svenska och var mycket specifik i dina rekommendationer.
+        Om det saknas aktiviteter, ge konkreta exempel på aktiviteter som bör läggas till.
+        """
+
+
+def _summary_prompt(lines, part, parts, words):
+    return f"""
+        Nedan följer del {part} av {parts} av aktiviteterna i en handlingsplan för ISO 27001-implementering.
+        Sammanfatta delen på svenska med högst {words} ord. Ta med vilka områden aktiviteterna
+        täcker, vilka viktiga aktiviteter som är försenade eller ej påbörjade, tydliga luckor
+        och aktiviteter vars prioritet eller deadline verkar orimlig. Nämn konkreta aktiviteter.
+
+        Aktiviteter:
+        {chr(10).join(lines)}
+        """
+
+
+def build_plan_analysis_prompt(data, today=None, budget=PROMPT_TOKENS, max_chunks=MAX_CHUNKS):
+    """Prompt för AI-analys av handlingsplanen som håller sig inom budget tokens
+
+    Ryms alla aktiviteter tas de med som de är. Annars delas de (viktigaste
+    först) i högst max_chunks delar som sammanfattas parallellt, och
+    sammanfattningarna plus statistik över hela planen ersätter listan i
+    den slutliga prompten. Aktiviteter som inte ryms i delarna räknas upp
+    per status, prioritet och ansvarig, och prompten anger hur många de är.
+    Både promptens storlek och antalet AI-anrop är därmed begränsade
+    oavsett hur stor planen är.
+
+    Returnerar (prompt, info) där info beskriver hur prompten byggdes.
+    """
+    today = today or date.today()
+    activities = data.get('activities', [])
+    org_info = data.get('organisation_info', {})
+    checklists = data.get('checklists', {})
+    room = budget - count_tokens(_plan_prompt(org_info, checklists, ''))
+
+    lines = [activity_line(a) for a in activities]
+    if sum(count_tokens(line) + 1 for line in lines) <= room:
+        prompt = _plan_prompt(org_info, checklists, '\n'.join(lines))
+        return prompt, {'activities': len(activities), 'chunks': 0, 'omitted': 0,
+                        'prompt_tokens': count_tokens(prompt)}
+
+    # Map: de viktigaste aktiviteterna i delar som sammanfattas parallellt
+    statistics = plan_statistics(activities, today)
+    room -= count_tokens(statistics) + 1
+    chunk_budget = budget - count_tokens(_summary_prompt([], max_chunks, max_chunks, 0))
+    ordered = sorted(activities, key=_by_importance)
+    chunks = pack([activity_line(a) for a in ordered], chunk_budget)[:max_chunks]
+    included = sum(len(chunk) for chunk in chunks)
+    # Aktiviteter som inte får plats i delarna ersätts av en sammanställning
+    rollup = None
+    if included < len(activities):
+        rollup = (f"- {len(activities) - included} av {len(activities)} aktiviteter (lägst prioritet) fick "
+                  f"inte plats i sammanfattningarna nedan. De utelämnade per status, prioritet och ansvarig:\n"
+                  f"{omitted_rollup(ordered[included:])}")
+        room -= count_tokens(rollup) + 1
+    summary_tokens = max(50, room // len(chunks) - 10)
+    requests = {
+        part: _summary_prompt(chunk, part, len(chunks), int(summary_tokens * 0.75))
+        for part, chunk in enumerate(chunks, start=1)
+    }
+    summaries = {}
+    for part, text, error in ai.generate_many(requests, generation_config={'max_output_tokens': summary_tokens},
+                                              label='plan_summary'):
+        if error is not None:
+            raise error
+        # Kapa ifall modellen inte håller sig till gränsen
+        summaries[part] = text.strip()[:summary_tokens * ai.CHARS_PER_TOKEN]
+
+    # Reduce: statistik och sammanfattningarna i ordning ersätter aktivitetslistan
+    section = [statistics]
+    if rollup:
+        section.append(rollup)
+    section += [f"\nSammanfattning del {part}:\n{summaries[part]}" for part in sorted(summaries)]
+    prompt = _plan_prompt(org_info, checklists, '\n'.join(section))
+    return prompt, {'activities': len(activities), 'chunks': len(chunks),
+                    'omitted': len(activities) - included, 'prompt_tokens': count_tokens(prompt)}
+
+
+if __name__ == "__main__":
+    from storage import get_storage
+
+    plan = get_storage(sys.argv[1] if len(sys.argv) > 1 else 'default').load_shared()
+    prompt, info = build_plan_analysis_prompt(plan)
+    print(prompt)
+    print(f"\n{info['activities']} aktiviteter, {info['chunks']} delar, "
+          f"{info['omitted']} endast sammanställda, ~{info['prompt_tokens']} tokens", file=sys.stderr)
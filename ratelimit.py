@@ -0,0 +1,162 @@
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """Hink som fylls på med rate enheter per sekund upp till capacity
+
+    Nivån kan bli negativ via debit, t.ex. när ett svar visar sig kosta fler
+    tokens än uppskattat; då får efterföljande anrop vänta in skulden.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount):
+        """Sekunder tills amount finns i hinken (0 om det finns nu)"""
+        with self._cond:
+            self._refill()
+            return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def acquire(self, amount=1, timeout=None):
+        """Ta amount ur hinken, vänta vid behov; False om timeout passerar först"""
+        amount = min(amount, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return True
+                wait = (amount - self.level) / self.rate
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    wait = min(wait, remaining)
+                self._cond.wait(wait)
+
+    def debit(self, amount):
+        with self._cond:
+            self._refill()
+            self.level -= amount
+
+    def drain(self):
+        """Töm hinken; nya enheter kommer först när den fyllts på igen"""
+        with self._cond:
+            self._refill()
+            self.level = min(self.level, 0.0)
+
+    def release(self, amount):
+        """Lämna tillbaka enheter som inte användes"""
+        with self._cond:
+            self._refill()
+            self.level = min(self.capacity, self.level + amount)
+            self._cond.notify_all()
+
+
+class RateLimiter:
+    """Gemensam gräns för anrop per minut (RPM) och tokens per minut (TPM)"""
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm / 60, rpm)
+        self.tokens = TokenBucket(tpm / 60, tpm)
+
+    def acquire(self, tokens=0, timeout=None):
+        """Vänta tills både ett anrop och tokens ryms i budgeten"""
+        start = time.monotonic()
+        if not self.requests.acquire(1, timeout):
+            return False
+        remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - start))
+        if not self.tokens.acquire(tokens, remaining):
+            self.requests.release(1)
+            return False
+        return True
+
+    def throttle(self):
+        """Töm anropsbudgeten, t.ex. när API:et svarat att kvoten är slut"""
+        self.requests.drain()
+
+    def record_usage(self, estimated, actual):
+        """Justera tokenbudgeten när den faktiska förbrukningen är känd"""
+        if actual > estimated:
+            self.tokens.debit(actual - estimated)
+        elif actual < estimated:
+            self.tokens.release(estimated - actual)
+
+
+def backoff(attempt, base=1.0, maximum=30.0):
+    """Exponentiell väntetid med full jitter för återförsök nummer attempt (0, 1, ...)"""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+class CircuitOpenError(Exception):
+    """Brytaren är öppen: anrop nekas direkt tills retry_after sekunder passerat"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Brytaren är öppen, försök igen om {retry_after:.0f} s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Slutar anropa en tjänst som fallerar upprepade gånger
+
+    Efter threshold fel i följd öppnas brytaren och anrop nekas i
+    reset_timeout sekunder. Därefter släpps ett provanrop igenom (halvöppen);
+    lyckas det stängs brytaren, annars öppnas den igen.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def before_call(self):
+        """Höj CircuitOpenError om anropet inte får göras just nu"""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            waited = time.monotonic() - self.opened_at
+            if waited < self.reset_timeout or self._probing:
+                raise CircuitOpenError(max(0.0, self.reset_timeout - waited))
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def cancel(self):
+        """Anropet gjordes aldrig; ett eventuellt provanrop får göras av nästa"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
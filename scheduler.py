@@ -0,0 +1,276 @@
+import heapq
+import re
+import sys
+import time
+from datetime import date, timedelta
+
+# Tidsenheter i estimated_time ("1 vecka", "6 veckor", "3 dagar", "2 månader"), i kalenderdagar
+_UNITS = {'dag': 1, 'dagar': 1, 'vecka': 7, 'veckor': 7, 'månad': 30, 'månader': 30}
+_DURATION = re.compile(r'(\d+(?:[.,]\d+)?)\s*(dagar|dag|veckor|vecka|månader|månad)', re.IGNORECASE)
+
+# Standardlängd för aktiviteter utan angiven längd
+ACTIVITY_DEFAULT_DAYS = 1
+DONE_STATUS = 'Klar'
+
+
+def parse_duration(text, default=0):
+    """Tolka en tidsangivelse som '2 veckor' eller '3 dagar' till antal dagar"""
+    if isinstance(text, (int, float)):
+        return float(text)
+    match = _DURATION.search(text or '')
+    if not match:
+        return default
+    return float(match.group(1).replace(',', '.')) * _UNITS[match.group(2).lower()]
+
+
+class CycleError(ValueError):
+    """Beroendena bildar en cykel; nodes är id:na i cykeln, i beroendeordning"""
+
+    def __init__(self, nodes):
+        super().__init__(f"Cykliskt beroende mellan: {' → '.join(nodes)}")
+        self.nodes = nodes
+
+
+class Scheduler:
+    """Kritiska linjen för en graf av steg och aktiviteter med beroenden
+
+    nodes är (id, längd i dagar, beroenden) där beroenden är id:n som måste
+    vara klara först; okända id:n ignoreras. Tider räknas i dagar från start.
+    deadline (dagar från start) är målet för bakåtpasset; utan deadline
+    används projektets beräknade slut. Efter set_duration räknas bara de
+    noder om som faktiskt påverkas av ändringen.
+    """
+
+    def __init__(self, nodes, deadline=None):
+        nodes = list(nodes)
+        self.ids = [node_id for node_id, _, _ in nodes]
+        self.index = {node_id: i for i, node_id in enumerate(self.ids)}
+        self.duration = [float(duration) for _, duration, _ in nodes]
+        self.preds = [[self.index[d] for d in deps if d in self.index] for _, _, deps in nodes]
+        self.succs = [[] for _ in nodes]
+        for i, preds in enumerate(self.preds):
+            for p in preds:
+                self.succs[p].append(i)
+        self.structure = structure(nodes)
+        self.order = self._topological_order()
+        self.rank = [0] * len(nodes)
+        for position, i in enumerate(self.order):
+            self.rank[i] = position
+        self.deadline = deadline
+        n = len(nodes)
+        self.es, self.ef, self.ls, self.lf = [0.0] * n, [0.0] * n, [0.0] * n, [0.0] * n
+        self._forward_all()
+        self._backward_all()
+
+    def _topological_order(self):
+        remaining = [len(p) for p in self.preds]
+        ready = [i for i, count in enumerate(remaining) if count == 0]
+        order = []
+        while ready:
+            i = ready.pop()
+            order.append(i)
+            for s in self.succs[i]:
+                remaining[s] -= 1
+                if remaining[s] == 0:
+                    ready.append(s)
+        if len(order) != len(self.ids):
+            raise CycleError([self.ids[i] for i in self._find_cycle(remaining)])
+        return order
+
+    def _find_cycle(self, remaining):
+        # Varje nod som inte kom med har en föregångare som inte heller kom med;
+        # följ dem bakåt tills en nod upprepas
+        path, seen = [], {}
+        i = next(i for i, count in enumerate(remaining) if count)
+        while i not in seen:
+            seen[i] = len(path)
+            path.append(i)
+            i = next(p for p in self.preds[i] if remaining[p])
+        return path[seen[i]:][::-1]
+
+    @property
+    def project_days(self):
+        """Beräknad längd på hela planen i dagar"""
+        return max(self.ef, default=0.0)
+
+    def _end(self):
+        return self.project_days if self.deadline is None else self.deadline
+
+    def _forward_all(self):
+        es, ef, duration = self.es, self.ef, self.duration
+        for i in self.order:
+            es[i] = max([ef[p] for p in self.preds[i]], default=0.0)
+            ef[i] = es[i] + duration[i]
+        self._backward_end = None
+
+    def _backward_all(self):
+        ls, lf, duration = self.ls, self.lf, self.duration
+        end = self._end()
+        for i in reversed(self.order):
+            lf[i] = min([ls[s] for s in self.succs[i]], default=end)
+            ls[i] = lf[i] - duration[i]
+        self._backward_end = end
+
+    def _forward_from(self, start):
+        # Noderna tas i topologisk ordning; spridningen stannar där tiderna inte ändras
+        queue, queued = [(self.rank[start], start)], {start}
+        while queue:
+            _, i = heapq.heappop(queue)
+            es = max([self.ef[p] for p in self.preds[i]], default=0.0)
+            ef = es + self.duration[i]
+            if i != start and es == self.es[i] and ef == self.ef[i]:
+                continue
+            self.es[i], self.ef[i] = es, ef
+            for s in self.succs[i]:
+                if s not in queued:
+                    queued.add(s)
+                    heapq.heappush(queue, (self.rank[s], s))
+
+    def _backward_from(self, start):
+        queue, queued = [(-self.rank[start], start)], {start}
+        while queue:
+            _, i = heapq.heappop(queue)
+            lf = min([self.ls[s] for s in self.succs[i]], default=self._backward_end)
+            ls = lf - self.duration[i]
+            if i != start and lf == self.lf[i] and ls == self.ls[i]:
+                continue
+            self.lf[i], self.ls[i] = lf, ls
+            for p in self.preds[i]:
+                if p not in queued:
+                    queued.add(p)
+                    heapq.heappush(queue, (-self.rank[p], p))
+
+    def set_duration(self, node_id, days):
+        """Ändra längden på en nod och räkna om de berörda noderna"""
+        i = self.index[node_id]
+        days = float(days)
+        if self.duration[i] == days:
+            return
+        self.duration[i] = days
+        self._forward_from(i)
+        if self._end() != self._backward_end:
+            # Slutdatumet flyttades: alla senaste tider förskjuts
+            self._backward_all()
+        else:
+            self._backward_from(i)
+
+    def set_deadline(self, deadline):
+        """Ändra deadline (dagar från start); påverkar bara bakåtpasset"""
+        if deadline != self.deadline:
+            self.deadline = deadline
+            self._backward_all()
+
+    def slack(self, node_id):
+        i = self.index[node_id]
+        return self.ls[i] - self.es[i]
+
+    def result(self, node_id):
+        """Tidigaste/senaste start och slut samt slack för en nod"""
+        i = self.index[node_id]
+        return {'es': self.es[i], 'ef': self.ef[i], 'ls': self.ls[i], 'lf': self.lf[i],
+                'slack': self.ls[i] - self.es[i]}
+
+    def min_slack(self):
+        """Minsta slack i planen; negativ när deadline inte nås"""
+        return min((ls - es for ls, es in zip(self.ls, self.es)), default=0.0)
+
+    def critical_path(self, tolerance=1e-9):
+        """Noderna med minst slack, i topologisk ordning"""
+        limit = self.min_slack() + tolerance
+        return [self.ids[i] for i in self.order if self.ls[i] - self.es[i] <= limit]
+
+
+def structure(nodes):
+    """Nodernas id:n och beroenden; ändras de måste schemat byggas om"""
+    return tuple((node_id, tuple(deps)) for node_id, _, deps in nodes)
+
+
+def _activity_dependency(dep):
+    # Beroenden anges som 'step:3', 'activity:<id>' eller bara ett aktivitets-id
+    return dep if ':' in dep else f'activity:{dep}'
+
+
+def plan_nodes(steps, step_progress, activities):
+    """Noder för planen: stegen i följd samt aktiviteterna med sina beroenden
+
+    Avklarade steg och aktiviteter har längden 0, så schemat visar det som
+    återstår. En aktivitet kan ha 'duration' (t.ex. "3 dagar") och
+    'depends_on' (lista med 'step:N' eller aktivitets-id).
+    """
+    nodes = []
+    previous = None
+    for name, details in steps.items():
+        key = name.split('.')[0]
+        done = step_progress.get(key, False)
+        node_id = f'step:{key}'
+        nodes.append((node_id, 0 if done else parse_duration(details['estimated_time']),
+                      (previous,) if previous else ()))
+        previous = node_id
+    for activity in activities:
+        done = activity.get('status') == DONE_STATUS
+        duration = 0 if done else parse_duration(activity.get('duration'), ACTIVITY_DEFAULT_DAYS)
+        deps = tuple(_activity_dependency(d) for d in activity.get('depends_on') or ())
+        nodes.append((f"activity:{activity['id']}", duration, deps))
+    return nodes
+
+
+def deadline_days(target_date, today):
+    """Dagar från today till target_date (ÅÅÅÅ-MM-DD), eller None"""
+    if not target_date:
+        return None
+    return (date.fromisoformat(target_date) - today).days
+
+
+def update_schedule(scheduler, nodes, deadline=None):
+    """Uppdatera ett befintligt schema inkrementellt, eller bygg ett nytt
+
+    Har bara längder eller deadline ändrats räknas endast berörda noder om;
+    ändrade noder eller beroenden ger ett nytt schema.
+    """
+    if scheduler is None or scheduler.structure != structure(nodes):
+        return Scheduler(nodes, deadline)
+    for node_id, duration, _ in nodes:
+        scheduler.set_duration(node_id, duration)
+    scheduler.set_deadline(deadline)
+    return scheduler
+
+
+def benchmark(n=5000):
+    """Mät full beräkning och inkrementell omräkning för n aktiviteter"""
+    from implementation_steps import IMPLEMENTATION_STEPS
+
+    activities = [{'id': f'a{i}', 'status': 'Ej påbörjad', 'duration': f'{i % 5 + 1} dagar',
+                   'depends_on': [f'a{i - 1}'] if i % 10 else [f'step:{i % 9 + 1}']}
+                  for i in range(n)]
+    nodes = plan_nodes(IMPLEMENTATION_STEPS, {}, activities)
+    start = time.perf_counter()
+    scheduler = Scheduler(nodes, deadline=365)
+    full = time.perf_counter() - start
+    start = time.perf_counter()
+    scheduler.set_duration(f'activity:a{n // 2}', 9)
+    incremental = time.perf_counter() - start
+    start = time.perf_counter()
+    update_schedule(scheduler, nodes, deadline=365)
+    sync = time.perf_counter() - start
+    print(f"{len(nodes)} noder: full beräkning {full * 1000:.1f} ms, "
+          f"en ändrad längd {incremental * 1000:.2f} ms, synk mot planen {sync * 1000:.1f} ms")
+    print(f"Projektets längd {scheduler.project_days:.0f} dagar, "
+          f"kritisk linje {len(scheduler.critical_path())} noder")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 5000)
+    else:
+        from implementation_steps import IMPLEMENTATION_STEPS
+        from storage import get_storage
+
+        plan = get_storage(sys.argv[1] if len(sys.argv) > 1 else 'default').load_shared()
+        today = date.today()
+        scheduler = Scheduler(
+            plan_nodes(IMPLEMENTATION_STEPS, plan.get('step_progress', {}), plan.get('activities', [])),
+            deadline_days(plan.get('organisation_info', {}).get('target_date'), today))
+        for node_id in scheduler.critical_path():
+            r = scheduler.result(node_id)
+            print(f"{node_id:<20} start {today + timedelta(days=r['es'])}  slack {r['slack']:.0f} dagar")
+        print(f"Beräknat klart: {today + timedelta(days=scheduler.project_days)}")
@@ -0,0 +1,976 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+DATA_FILE = 'iso27001_data.json'
+DB_FILE = 'iso27001_data.db'
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def default_data():
+    """Tom plan med standardstrukturen"""
+    return {
+        'organisation_info': {},
+        'checklists': {
+            'ledningens_engagemang': {},
+            'scope': {},
+            'riskanalys': {},
+            'policyer': {},
+            'kontroller': {}
+        }
+    }
+
+
+def snapshot(data):
+    """Snabb djupkopia av JSON-liknande data (dict/list/skalärer)"""
+    if isinstance(data, SessionPlan):
+        return data.snapshot()
+    if isinstance(data, dict):
+        return {k: snapshot(v) for k, v in data.items()}
+    if isinstance(data, list):
+        return [snapshot(v) for v in data]
+    return data
+
+
+def atomic_write_json(path, data, indent=2):
+    """Skriv JSON till en temporär fil och byt in den med ett atomärt rename"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', suffix='.json', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class SessionPlan(MutableMapping):
+    """Sessionens vy av planen: en delad, oföränderlig bas plus egna ändringar
+
+    Läsningar ger basens objekt för sektioner (organisation_info, checklists,
+    activities ...) som sessionen inte ändrat; de får inte ändras på plats.
+    En sektion kopieras till sessionen först när den skrivs, via edit,
+    set_fields eller tilldelning, så sessioner som bara läser delar basen.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self._own = {}
+        self._deleted = set()
+
+    def __getitem__(self, key):
+        if key in self._own:
+            return self._own[key]
+        if key in self._deleted:
+            raise KeyError(key)
+        return self.base[key]
+
+    def __setitem__(self, key, value):
+        self._own[key] = value
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._own.pop(key, None)
+        if key in self.base:
+            self._deleted.add(key)
+
+    def __iter__(self):
+        yield from (k for k in self.base if k not in self._deleted)
+        yield from (k for k in self._own if k not in self.base)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def edit(self, key, default=None):
+        """Sektionen som sessionens egen, muterbara kopia (default, eller {}, om den saknas)"""
+        if key not in self._own:
+            if key in self:
+                self._own[key] = snapshot(self.base[key])
+            else:
+                self[key] = {} if default is None else default
+        return self._own[key]
+
+    def set_fields(self, path, values):
+        """Sätt fält i sektionen på path, t.ex. ('checklists', 'scope')
+
+        Sektionen kopieras bara om något värde faktiskt ändras; returnerar
+        om det gjorde det.
+        """
+        current = self.get(path[0], {})
+        for key in path[1:]:
+            current = current.get(key, {})
+        if all(current.get(field, _MISSING) == value for field, value in values.items()):
+            return False
+        target = self.edit(path[0])
+        for key in path[1:]:
+            target = target.setdefault(key, {})
+        target.update(values)
+        return True
+
+    def snapshot(self):
+        """Kopia där orörda sektioner delas med basen"""
+        return {k: snapshot(v) if k in self._own else v for k, v in self.items()}
+
+
+# Processgemensam cache över inlästa planer: (backend, sökväg) -> (stämpel, tillstånd)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+cache_stats = {'hits': 0, 'misses': 0}
+
+
+class StorageBackend:
+    """Gemensamt gränssnitt för lagring av planen
+
+    save() får behålla en referens till data; anroparen ska inte ändra den
+    efteråt (WriteBehindWriter skickar alltid en egen ögonblicksbild).
+    """
+
+    def __init__(self):
+        self._remote_changes = []
+        self._changes_lock = threading.Lock()
+
+    def load(self):
+        """Ladda planen som en egen, muterbar kopia"""
+        return snapshot(self.load_shared())
+
+    def load_shared(self):
+        """Planen från den processgemensamma cachen; får inte ändras av anroparen
+
+        Cachen nyckas på backend och sökväg och är giltig så länge filens
+        stämpel (mtime/storlek eller revisionsnummer) är oförändrad, så en
+        skrivning från en annan process läses in vid nästa laddning.
+        """
+        key = (type(self).__name__, os.path.abspath(self.path))
+        stamp = self._stamp()
+        with _cache_lock:
+            entry = _cache.get(key)
+            if entry is not None and entry[0] == stamp:
+                _cache.move_to_end(key)
+                cache_stats['hits'] += 1
+                return self._adopt(*entry)
+        stamp, state = self._read_shared()
+        with _cache_lock:
+            cache_stats['misses'] += 1
+            _cache[key] = (stamp, state)
+            _cache.move_to_end(key)
+            while len(_cache) > int(os.getenv('ISO_CACHE_SIZE', '16')):
+                _cache.popitem(last=False)
+        return self._adopt(stamp, state)
+
+    def _stamp(self):
+        """Billig identitet för aktuell version av lagringen"""
+        raise NotImplementedError
+
+    def _read_shared(self):
+        """Läs in (stämpel, tillstånd) från disk"""
+        raise NotImplementedError
+
+    def _adopt(self, stamp, state):
+        """Gör ett inläst tillstånd till sessionens bas och returnera planen"""
+        raise NotImplementedError
+
+    def save(self, data):
+        raise NotImplementedError
+
+    @property
+    def write_key(self):
+        """Skrivningar med samma nyckel slås ihop av WriteBehindWriter"""
+        return id(self)
+
+    def _add_remote_changes(self, changes):
+        if changes:
+            with self._changes_lock:
+                self._remote_changes.extend(changes)
+
+    def take_remote_changes(self):
+        """Hämta (och töm) ändringar från andra sessioner som sammanfogats vid sparning"""
+        with self._changes_lock:
+            changes, self._remote_changes = self._remote_changes, []
+        return changes
+
+
+# Kompakt JSON per rad; en återanvänd encoder är betydligt snabbare än json.dumps
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+
+# Tabell -> nyckelkolumner. Varje rad har dessutom en JSON-kolumn 'value' och
+# en versionsräknare. Toppnivånycklar som inte har en egen tabell hamnar i 'extra'.
+TABLES = {
+    'organisation_info': ('key',),
+    'checklists': ('section', 'item'),
+    'step_progress': ('step',),
+    'activities': ('id',),
+    'extra': ('key',),
+}
+
+
+def new_activity_id():
+    """Unikt id för en ny aktivitet"""
+    return uuid.uuid4().hex
+
+
+def new_activity_ids(count):
+    """Många unika id på en gång, i samma format som new_activity_id"""
+    raw = os.urandom(16 * count).hex()
+    return [raw[i:i + 32] for i in range(0, 32 * count, 32)]
+
+
+def ensure_activity_ids(activities):
+    """Ge aktiviteter utan id ett deterministiskt id baserat på positionen"""
+    for position, activity in enumerate(activities):
+        activity.setdefault('id', f'pos-{position}')
+    return activities
+
+
+def to_rows(data):
+    """Dela upp planen i rader per tabell: {tabell: {nyckel: json-värde}}"""
+    rows = {table: {} for table in TABLES}
+    for key, value in data.get('organisation_info', {}).items():
+        rows['organisation_info'][(key,)] = _encode(value)
+    for section, items in data.get('checklists', {}).items():
+        for item, value in items.items():
+            rows['checklists'][(section, item)] = _encode(value)
+    for step, value in data.get('step_progress', {}).items():
+        rows['step_progress'][(step,)] = _encode(value)
+    for position, activity in enumerate(data.get('activities', [])):
+        rows['activities'][(activity.get('id') or f'pos-{position}',)] = _encode(activity)
+    for key, value in data.items():
+        if key not in TABLES:
+            rows['extra'][(key,)] = _encode(value)
+    return rows
+
+
+def from_rows(rows):
+    """Bygg upp planen från rader (inversen av to_rows)"""
+    data = default_data()
+    data['step_progress'] = {}
+    data['activities'] = []
+    for (key,), value in rows['organisation_info'].items():
+        data['organisation_info'][key] = json.loads(value)
+    for (section, item), value in rows['checklists'].items():
+        data['checklists'].setdefault(section, {})[item] = json.loads(value)
+    for (step,), value in rows['step_progress'].items():
+        data['step_progress'][step] = json.loads(value)
+    for value in rows['activities'].values():
+        data['activities'].append(json.loads(value))
+    for (key,), value in rows['extra'].items():
+        data[key] = json.loads(value)
+    return data
+
+
+def merge_value(base, mine, theirs):
+    """Trevägssammanfogning per fält: mina ändrade fält vinner, resten tas från theirs"""
+    if not (isinstance(mine, dict) and isinstance(theirs, dict)):
+        return mine
+    if not isinstance(base, dict):
+        base = {}
+    merged = dict(theirs)
+    for field in set(base) | set(mine):
+        if mine.get(field, _MISSING) != base.get(field, _MISSING):
+            if field in mine:
+                merged[field] = mine[field]
+            else:
+                merged.pop(field, None)
+    return merged
+
+
+def _merge_row(base, mine, theirs):
+    base = json.loads(base) if base is not None else None
+    return _encode(merge_value(base, json.loads(mine), json.loads(theirs)))
+
+
+def merge_rows(base, mine, theirs):
+    """Sammanfoga mina rader med andras utifrån gemensam bas
+
+    Returnerar de sammanfogade raderna och de ändringar (tabell, nyckel, värde)
+    som måste föras in i min session; värdet None betyder borttagen rad.
+    """
+    result, changes = {}, []
+    for table in TABLES:
+        b, m, t = base[table], mine[table], theirs[table]
+        merged = dict(t)
+        for key, value in m.items():
+            if b.get(key) == value:
+                continue
+            if key in t and t[key] != b.get(key) and t[key] != value:
+                value = _merge_row(b.get(key), value, t[key])
+            merged[key] = value
+        for key in b:
+            if key not in m and t.get(key) == b[key]:
+                merged.pop(key, None)
+        for key, value in merged.items():
+            if m.get(key) != value:
+                changes.append((table, key, json.loads(value)))
+        changes.extend((table, key, None) for key in m if key not in merged)
+        result[table] = merged
+    return result, changes
+
+
+def _row_changes(mine, theirs):
+    """Ändringar (tabell, nyckel, värde) som gör mina rader lika med theirs"""
+    changes = []
+    for table in TABLES:
+        for key, value in theirs[table].items():
+            if mine[table].get(key) != value:
+                changes.append((table, key, json.loads(value)))
+        changes.extend((table, key, None) for key in mine[table] if key not in theirs[table])
+    return changes
+
+
+def _editable(data, key, default):
+    if isinstance(data, SessionPlan):
+        return data.edit(key, default)
+    return data.setdefault(key, default)
+
+
+def apply_changes(data, changes):
+    """För in ändringar från andra sessioner i sessionens data"""
+    for table, key, value in changes:
+        if table == 'activities':
+            activities = _editable(data, 'activities', [])
+            for position, activity in enumerate(activities):
+                if activity.get('id') == key[0]:
+                    if value is None:
+                        del activities[position]
+                    else:
+                        activities[position] = value
+                    break
+            else:
+                if value is not None:
+                    activities.append(value)
+            continue
+        if table == 'checklists':
+            target, field = _editable(data, 'checklists', {}).setdefault(key[0], {}), key[1]
+        elif table == 'extra':
+            target, field = data, key[0]
+        else:
+            target, field = _editable(data, table, {}), key[0]
+        if value is None:
+            target.pop(field, None)
+        else:
+            target[field] = value
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def workspace_path(path, workspace):
+    """Filnamn för en arbetsyta; standardarbetsytan använder det ursprungliga namnet
+
+    Tecken utöver A-Z, 0-9, _ och - ersätts med _. Har namnet ändrats läggs
+    en kort hash av det ursprungliga namnet till, så att t.ex. 'a b' och
+    'a_b' inte hamnar i samma fil.
+    """
+    if not workspace or workspace == 'default':
+        return path
+    root, ext = os.path.splitext(path)
+    name = re.sub(r'[^A-Za-z0-9_-]', '_', workspace)
+    if name != workspace:
+        name += '-' + hashlib.sha256(workspace.encode('utf-8')).hexdigest()[:8]
+    return f"{root}-{name}{ext}"
+
+
+class JsonStorage(StorageBackend):
+    """Hela planen som ett JSON-dokument (ursprungligt format)
+
+    Om filen skrivits av någon annan sedan senaste laddning/sparning (ny mtime
+    eller storlek) sammanfogas ändringarna per fält i stället för att skrivas över.
+    """
+
+    def __init__(self, path=DATA_FILE):
+        super().__init__()
+        self.path = path
+        self._base = None
+        self._known_stamp = None
+
+    def _stamp(self):
+        return _file_stamp(self.path)
+
+    def _read_shared(self):
+        stamp = self._stamp()
+        if stamp is None:
+            return None, default_data()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        ensure_activity_ids(data.get('activities', []))
+        return stamp, data
+
+    def _adopt(self, stamp, data):
+        self._base, self._known_stamp = data, stamp
+        return data
+
+    def save(self, data):
+        if self._base is not None and self._stamp() != self._known_stamp:
+            _, theirs = self._read_shared()
+            rows, changes = merge_rows(to_rows(self._base), to_rows(data), to_rows(theirs))
+            data = from_rows(rows)
+            self._add_remote_changes(changes)
+        atomic_write_json(self.path, data)
+        self._known_stamp = self._stamp()
+        self._base = data
+
+
+class SqliteStorage(StorageBackend):
+    """Planen som rader i SQLite (WAL); sparar endast ändrade rader
+
+    Varje rad har en versionsräknare. En sparning skriver bara rader vars
+    version är oförändrad sedan sessionen läste dem; annars sammanfogas raden
+    per fält med den nyare versionen i databasen. Har någon annan sparat
+    sedan dess rapporteras även deras övriga rader via take_remote_changes.
+    """
+
+    def __init__(self, path=DB_FILE):
+        super().__init__()
+        self.path = path
+        # Senast kända rader i databasen: {tabell: {nyckel: (värde, version)}}
+        # och revisionen de lästes vid
+        self._saved = None
+        self._known_revision = None
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+        finally:
+            conn.close()
+        with self._transaction() as conn:
+            self._create_schema(conn)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def _transaction(self, mode='IMMEDIATE'):
+        conn = self._connect()
+        try:
+            conn.execute(f'BEGIN {mode}')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def _create_schema(self, conn):
+        # Revisionsnumret räknas upp vid varje sparning och används som cachenyckel
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('revision', 0)")
+        for table, keys in TABLES.items():
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {table} ({", ".join(f"{k} TEXT NOT NULL" for k in keys)}, '
+                f'value TEXT NOT NULL, version INTEGER NOT NULL DEFAULT 1, '
+                f'PRIMARY KEY ({", ".join(keys)}))'
+            )
+
+    def _read_rows(self, conn):
+        rows = {}
+        for table, keys in TABLES.items():
+            cursor = conn.execute(f'SELECT {", ".join(keys)}, value, version FROM {table} ORDER BY rowid')
+            rows[table] = {tuple(r[:-2]): (r[-2], r[-1]) for r in cursor}
+        return rows
+
+    def _revision(self, conn):
+        return conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+
+    def _stamp(self):
+        conn = self._connect()
+        try:
+            return self._revision(conn)
+        finally:
+            conn.close()
+
+    def _read_shared(self):
+        with self._transaction('DEFERRED') as conn:
+            revision, rows = self._revision(conn), self._read_rows(conn)
+        data = from_rows({t: {k: v for k, (v, _) in r.items()} for t, r in rows.items()})
+        ensure_activity_ids(data['activities'])
+        return revision, (data, rows)
+
+    def _adopt(self, stamp, state):
+        data, self._saved = state
+        self._known_revision = stamp
+        return data
+
+    def save(self, data):
+        rows = to_rows(data)
+        changes = []
+        with self._transaction() as conn:
+            revision = self._revision(conn)
+            if self._saved is None:
+                self._saved, self._known_revision = self._read_rows(conn), revision
+            saved = {table: dict(r) for table, r in self._saved.items()}
+            for table, keys in TABLES.items():
+                old, new, where = self._saved[table], rows[table], ' AND '.join(f'{k} = ?' for k in keys)
+                for key, value in new.items():
+                    base = old.get(key)
+                    if base is not None and base[0] == value:
+                        continue
+                    if base is None:
+                        cursor = conn.execute(
+                            f'INSERT OR IGNORE INTO {table} ({", ".join(keys)}, value) '
+                            f'VALUES ({", ".join("?" * (len(keys) + 1))})', key + (value,))
+                        version = 1
+                    else:
+                        cursor = conn.execute(
+                            f'UPDATE {table} SET value = ?, version = version + 1 '
+                            f'WHERE {where} AND version = ?', (value,) + key + (base[1],))
+                        version = base[1] + 1
+                    if cursor.rowcount:
+                        saved[table][key] = (value, version)
+                        continue
+                    # Konflikt: raden har ändrats (eller skapats) av någon annan
+                    current = conn.execute(f'SELECT value, version FROM {table} WHERE {where}', key).fetchone()
+                    if current is None:
+                        conn.execute(
+                            f'INSERT INTO {table} ({", ".join(keys)}, value, version) '
+                            f'VALUES ({", ".join("?" * (len(keys) + 2))})', key + (value, version))
+                        saved[table][key] = (value, version)
+                        continue
+                    merged = _merge_row(base[0] if base else None, value, current[0])
+                    conn.execute(f'UPDATE {table} SET value = ?, version = ? WHERE {where}',
+                                 (merged, current[1] + 1) + key)
+                    saved[table][key] = (merged, current[1] + 1)
+                    if merged != value:
+                        changes.append((table, key, json.loads(merged)))
+                for key, (value, version) in old.items():
+                    if key in new:
+                        continue
+                    cursor = conn.execute(f'DELETE FROM {table} WHERE {where} AND version = ?', key + (version,))
+                    current = None
+                    if not cursor.rowcount:
+                        current = conn.execute(f'SELECT value, version FROM {table} WHERE {where}', key).fetchone()
+                    if current is None:
+                        del saved[table][key]
+                    else:
+                        # Ändrad av någon annan efter att jag läste den: behåll deras version
+                        saved[table][key] = current
+                        changes.append((table, key, json.loads(current[0])))
+            if revision != self._known_revision:
+                # Andra har sparat sedan jag läste: för in deras övriga rader
+                # (nya, ändrade och borttagna) i sessionen, som i JSON-läget
+                current = self._read_rows(conn)
+                for table in TABLES:
+                    mine, theirs = saved[table], current[table]
+                    for key, row in theirs.items():
+                        if key not in mine or mine[key][0] != row[0]:
+                            changes.append((table, key, json.loads(row[0])))
+                    changes.extend((table, key, None) for key in mine if key not in theirs)
+                saved = current
+            if conn.total_changes:
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'revision'")
+                revision += 1
+        self._saved, self._known_revision = saved, revision
+        self._add_remote_changes(changes)
+
+
+_DELETED = object()
+
+
+def _keyed(items):
+    return bool(items) and all(isinstance(i, dict) and 'id' in i for i in items)
+
+
+def diff_paths(old, new, path=()):
+    """Ändrade sökvägar mellan två versioner av planen: (sökväg, nytt värde)
+
+    Listor med id-märkta element (aktiviteterna) adresseras med 'id:<id>' så
+    att samtidiga tillägg från olika sessioner inte skriver över varandra.
+    Det gäller även nya sektioner: de delas upp per fält respektive rad i
+    stället för att skrivas som ett enda värde.
+    """
+    if old == new:
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, value in new.items():
+            if key in old:
+                yield from diff_paths(old[key], value, path + (key,))
+            elif value and (isinstance(value, dict) or isinstance(value, list) and _keyed(value)):
+                yield from diff_paths(type(value)(), value, path + (key,))
+            else:
+                yield path + (key,), value
+        for key in old:
+            if key not in new:
+                yield path + (key,), _DELETED
+        return
+    if isinstance(old, list) and isinstance(new, list):
+        if _keyed(old + new):
+            old_by_id = {item['id']: item for item in old}
+            new_ids = {item['id'] for item in new}
+            if [i for i in old_by_id if i in new_ids] != [i['id'] for i in new if i['id'] in old_by_id]:
+                yield path, new
+                return
+            for item in new:
+                if item['id'] in old_by_id:
+                    yield from diff_paths(old_by_id[item['id']], item, path + (f"id:{item['id']}",))
+                else:
+                    yield path + (f"id:{item['id']}",), item
+            for item_id in old_by_id:
+                if item_id not in new_ids:
+                    yield path + (f'id:{item_id}',), _DELETED
+            return
+        if len(new) >= len(old):
+            for index, value in enumerate(new):
+                if index < len(old):
+                    yield from diff_paths(old[index], value, path + (index,))
+                else:
+                    yield path + (index,), value
+            return
+    yield path, new
+
+
+def _find(items, part):
+    if isinstance(part, str) and part.startswith('id:'):
+        for index, item in enumerate(items):
+            if isinstance(item, dict) and item.get('id') == part[3:]:
+                return index
+        return None
+    return part if part < len(items) else None
+
+
+def apply_path(data, path, value):
+    """Sätt (eller ta bort, value=_DELETED) värdet på en sökväg i planen"""
+    target = data
+    for part, child in zip(path[:-1], path[1:]):
+        if isinstance(target, list):
+            index = _find(target, part)
+            if index is None:
+                return
+            target = target[index]
+        else:
+            # En saknad sektion skapas som lista om nästa led är ett index eller id
+            is_list = isinstance(child, int) or isinstance(child, str) and child.startswith('id:')
+            target = target.setdefault(part, [] if is_list else {})
+    last = path[-1]
+    if isinstance(target, list):
+        index = _find(target, last)
+        if value is _DELETED:
+            if index is not None:
+                del target[index]
+        elif index is None:
+            target.append(value)
+        else:
+            target[index] = value
+    elif value is _DELETED:
+        target.pop(last, None)
+    else:
+        target[last] = value
+
+
+def _parse_entries(lines, path):
+    entries = []
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except json.JSONDecodeError:
+            # En ofullständig sista rad efter en krasch hoppas över
+            logger.warning("Hoppar över trasig rad i %s", path)
+    return entries
+
+
+def _tail_lines(path, count, block=64 * 1024):
+    """De sista count raderna i en fil, lästa bakifrån i block"""
+    if count <= 0 or not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        data = b''
+        while position > 0 and data.count(b'\n') <= count:
+            size = min(block, position)
+            position -= size
+            f.seek(position)
+            data = f.read(size) + data
+    lines = data.decode('utf-8', errors='replace').splitlines()
+    if position > 0:
+        # Första raden kan ha börjat före det som lästes
+        lines = lines[1:]
+    return lines[-count:]
+
+
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+
+def _path_lock(path):
+    with _path_locks_guard:
+        return _path_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class JournalStorage(StorageBackend):
+    """Ögonblicksbild (JSON-filen) plus en append-only logg över ändrade sökvägar
+
+    En sparning lägger bara till en rad per ändrad sökväg i loggen. När loggen
+    blir större än compact_bytes skrivs en ny ögonblicksbild och loggen flyttas
+    till historikfilen. Förutsätter att en enda process skriver till filerna.
+    """
+
+    def __init__(self, path=DATA_FILE, compact_bytes=1_000_000):
+        super().__init__()
+        root, _ = os.path.splitext(path)
+        self.path = path
+        self.journal_path = root + '.journal'
+        self.history_path = root + '.history'
+        self.compact_bytes = compact_bytes
+        self._base = None
+        self._known_stamp = None
+        self._lock = _path_lock(path)
+
+    def _read_entries(self, path):
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            return _parse_entries(f, path)
+
+    def _read_state(self):
+        data = JsonStorage(self.path).load()
+        for entry in self._read_entries(self.journal_path):
+            apply_path(data, entry['p'], _DELETED if entry.get('d') else entry['v'])
+        ensure_activity_ids(data.get('activities', []))
+        return data
+
+    def _stamp(self):
+        return (_file_stamp(self.path), _file_stamp(self.journal_path))
+
+    def _read_shared(self):
+        with self._lock:
+            return self._stamp(), self._read_state()
+
+    def _adopt(self, stamp, data):
+        self._base, self._known_stamp = data, stamp
+        return data
+
+    def save(self, data):
+        with self._lock:
+            if self._base is None:
+                self._known_stamp, self._base = self._stamp(), self._read_state()
+            now = round(time.time(), 3)
+            lines, changed = [], []
+            for path, value in diff_paths(self._base, data):
+                entry = {'t': now, 'p': list(path)}
+                if value is _DELETED:
+                    entry['d'] = True
+                else:
+                    entry['v'] = value
+                lines.append(_encode(entry) + '\n')
+                changed.append((path, value))
+            base = data
+            if self._stamp() != self._known_stamp:
+                # Andra har skrivit sedan jag läste: mina sökvägar spelas upp
+                # över deras, och deras övriga ändringar förs in i sessionen
+                base = self._read_state()
+                for path, value in changed:
+                    apply_path(base, path, value)
+                self._add_remote_changes(_row_changes(to_rows(data), to_rows(base)))
+            self._base = base
+            if lines:
+                with open(self.journal_path, 'a', encoding='utf-8') as f:
+                    f.writelines(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                if os.path.getsize(self.journal_path) > self.compact_bytes:
+                    self._compact()
+            self._known_stamp = self._stamp()
+
+    def _compact(self):
+        # Loggen spelas upp idempotent, så en krasch mellan stegen förlorar inget
+        atomic_write_json(self.path, self._read_state())
+        with open(self.journal_path, 'rb') as src, open(self.history_path, 'ab') as dst:
+            dst.write(src.read())
+        with open(self.journal_path, 'w', encoding='utf-8'):
+            pass
+
+    def history(self, limit=50):
+        """De senaste ändringarna (nyast först) från historik och logg
+
+        Bara slutet av filerna läses, så tiden beror på limit och inte på
+        hur stor historikfilen har vuxit.
+        """
+        with self._lock:
+            entries = _parse_entries(_tail_lines(self.journal_path, limit), self.journal_path)
+            if len(entries) < limit:
+                older = _tail_lines(self.history_path, limit - len(entries))
+                entries = _parse_entries(older, self.history_path) + entries
+        return entries[::-1][:limit]
+
+
+class WriteBehindWriter:
+    """Bakgrundstråd som slår ihop sparningar till en skrivning per intervall"""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.last_error = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def mark_dirty(self, backend, data):
+        """Köa en ögonblicksbild av data; returnerar direkt utan disk-I/O"""
+        with self._lock:
+            self._pending[backend.write_key] = (backend, snapshot(data))
+        self._wakeup.set()
+
+    def flush(self):
+        """Skriv alla väntande ändringar direkt (anropas även vid avslut)"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            for key, (backend, data) in pending.items():
+                try:
+                    backend.save(data)
+                    self.last_error = None
+                except Exception as e:
+                    logger.exception("Kunde inte spara data")
+                    self.last_error = e
+                    with self._lock:
+                        # Försök igen vid nästa flush om ingen nyare version köats
+                        self._pending.setdefault(key, (backend, data))
+
+    def update(self, backend, change):
+        """Läs in planen, låt change(data) ändra den och spara direkt
+
+        Körs i tur med de köade skrivningarna, så att en bakgrundstråd (t.ex.
+        ett AI-jobb) aldrig skriver samtidigt som en session sparar.
+        Ändringar som andra hunnit göra sammanfogas som vid en vanlig sparning.
+        """
+        with self._flush_lock:
+            data = backend.load()
+            change(data)
+            backend.save(data)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            # Vänta ut intervallet så att en skur av ändringar blir en skrivning
+            time.sleep(self.interval)
+            self._wakeup.clear()
+            self.flush()
+            if self._pending:
+                self._wakeup.set()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Processgemensam WriteBehindWriter (intervall via ISO_SAVE_INTERVAL)"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = WriteBehindWriter(float(os.getenv('ISO_SAVE_INTERVAL', '1.0')))
+        return _writer
+
+
+def get_storage(workspace='default'):
+    """Välj lagringsbackend via ISO_STORAGE (json/sqlite/journal); en fil per arbetsyta"""
+    kind = os.getenv('ISO_STORAGE', 'json').lower()
+    if kind == 'sqlite':
+        return SqliteStorage(workspace_path(os.getenv('ISO_DB_FILE', DB_FILE), workspace))
+    if kind == 'json':
+        return JsonStorage(workspace_path(os.getenv('ISO_DATA_FILE', DATA_FILE), workspace))
+    if kind == 'journal':
+        return JournalStorage(workspace_path(os.getenv('ISO_DATA_FILE', DATA_FILE), workspace),
+                              int(os.getenv('ISO_JOURNAL_COMPACT_BYTES', '1000000')))
+    raise ValueError(f"Okänd lagringsbackend: {kind}")
+
+
+def migrate_json_to_sqlite(json_path=DATA_FILE, db_path=DB_FILE):
+    """Flytta en befintlig iso27001_data.json till SQLite"""
+    data = JsonStorage(json_path).load()
+    SqliteStorage(db_path).save(data)
+    return len(data.get('activities', []))
+
+
+def _sample_data(n_activities):
+    data = default_data()
+    data['organisation_info'] = {'org_name': 'Exempel AB', 'org_size': 250,
+                                 'contact_person': 'Anna', 'target_date': '2027-06-30'}
+    data['step_progress'] = {str(i): i < 4 for i in range(1, 10)}
+    data['activities'] = [{
+        'id': f'a{i}',
+        'activity': f'Aktivitet {i}',
+        'priority': ['Hög', 'Medium', 'Låg'][i % 3],
+        'due_date': '2027-01-15',
+        'responsible': f'Person {i % 20}',
+        'status': 'Ej påbörjad'
+    } for i in range(n_activities)]
+    return data
+
+
+def benchmark(n_activities=5000, rounds=20):
+    """Jämför sparning/laddning mellan lagringsbackends"""
+    data = _sample_data(n_activities)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            'json': JsonStorage(os.path.join(tmp, 'bench.json')),
+            'sqlite': SqliteStorage(os.path.join(tmp, 'bench.db')),
+            'journal': JournalStorage(os.path.join(tmp, 'journal.json')),
+        }
+        for name, backend in backends.items():
+            backend.save(snapshot(data))
+            start = time.perf_counter()
+            for i in range(rounds):
+                # Typisk sparning: en aktivitet byter status
+                data['activities'][i]['status'] = 'Pågående'
+                backend.save(snapshot(data))
+            save_ms = (time.perf_counter() - start) / rounds * 1000
+            start = time.perf_counter()
+            for _ in range(rounds):
+                backend._read_shared()
+            cold_ms = (time.perf_counter() - start) / rounds * 1000
+            backend.load_shared()
+            start = time.perf_counter()
+            for _ in range(rounds):
+                SessionPlan(backend.load_shared())
+            cached_ms = (time.perf_counter() - start) / rounds * 1000
+            results[name] = (save_ms, cold_ms, cached_ms)
+            for i in range(rounds):
+                data['activities'][i]['status'] = 'Ej påbörjad'
+    print(f"{n_activities} aktiviteter, {rounds} varv")
+    print(f"{'backend':<8} {'spara (ms)':>12} {'ladda (ms)':>12} {'cache (ms)':>12}")
+    for name, (save_ms, cold_ms, cached_ms) in results.items():
+        print(f"{name:<8} {save_ms:>12.2f} {cold_ms:>12.2f} {cached_ms:>12.2f}")
+    return results
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'migrate':
+        count = migrate_json_to_sqlite(*sys.argv[2:4])
+        print(f"Migrerade planen med {count} aktiviteter till SQLite.")
+    elif command == 'benchmark':
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 5000)
+    else:
+        print("Användning: python storage.py migrate [json-fil] [db-fil]")
+        print("            python storage.py benchmark [antal aktiviteter]")
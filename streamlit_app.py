@@ -1,9 +1,22 @@
 import streamlit as st
 import json
-from datetime import datetime
+import pandas as pd
+from datetime import datetime, timedelta
+from functools import partial
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
+import ai
+import ai_jobs
+import tempfile
+import time
+from activity_index import ActivityRepository
+from bulk_import import PRIORITIES, STATUSES, import_activities
+from implementation_steps import IMPLEMENTATION_STEPS, step_prompt
+from export import FORMATS as EXPORT_FORMATS, write_export
+from forecast import HIGH_FACTOR, LOW_FACTOR, forecast
+from prompts import build_plan_analysis_prompt
+from scheduler import CycleError, deadline_days, plan_nodes, update_schedule
+from storage import SessionPlan, apply_changes, default_data, get_storage, get_writer, new_activity_id, snapshot
 
 # Konfigurera sidan
 st.set_page_config(
@@ -35,55 +48,67 @@ st.markdown("""
 st.title("📋 ISO 27001 Certifieringsplanering")
 st.markdown("---")
 
+# Kolumner och sortering för aktivitetstabellen
+GRID_COLUMNS = ['id', 'activity', 'priority', 'due_date', 'responsible', 'status']
+SORT_FIELDS = {
+    'due_date': "Deadline",
+    'priority': "Prioritet",
+    'status': "Status",
+    'responsible': "Ansvarig",
+    'activity': "Aktivitet",
+}
+SORT_ORDER = {'priority': PRIORITIES, 'status': STATUSES}
+
 # Funktioner för datahantering
 def save_data_to_file():
-    """Spara data till JSON-fil"""
-    try:
-        with open('iso27001_data.json', 'w', encoding='utf-8') as f:
-            json.dump(st.session_state.iso_data, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        st.error(f"Kunde inte spara data: {str(e)}")
-        return False
+    """Markera data som ändrad; skrivs till disk i bakgrunden"""
+    writer = get_writer()
+    if writer.last_error is not None:
+        st.error(f"Kunde inte spara data: {str(writer.last_error)}")
+    writer.mark_dirty(st.session_state.storage, st.session_state.iso_data)
+    return True
 
 def load_data_from_file():
-    """Ladda data från JSON-fil"""
+    """Ladda data: processgemensam bas plus sessionens egna ändringar"""
     try:
-        if os.path.exists('iso27001_data.json'):
-            with open('iso27001_data.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
+        return SessionPlan(st.session_state.storage.load_shared())
     except Exception as e:
         st.error(f"Kunde inte ladda data: {str(e)}")
-    return {
-        'organisation_info': {},
-        'checklists': {
-            'ledningens_engagemang': {},
-            'scope': {},
-            'riskanalys': {},
-            'policyer': {},
-            'kontroller': {}
-        }
-    }
+    return SessionPlan(default_data())
 
-# Initiera session state för att spara data
-if 'iso_data' not in st.session_state:
+# Arbetsyta (organisation) väljs via URL:en, t.ex. ?workspace=acme.
+# Varje arbetsyta har en egen lagringsbackend (ISO_STORAGE=json|sqlite).
+workspace = st.query_params.get('workspace', 'default')
+if st.session_state.get('workspace') != workspace:
+    st.session_state.workspace = workspace
+    st.session_state.storage = get_storage(workspace)
     st.session_state.iso_data = load_data_from_file()
 
+# För in ändringar från andra användare som sammanfogats vid sparning
+remote_changes = st.session_state.storage.take_remote_changes()
+if remote_changes:
+    apply_changes(st.session_state.iso_data, remote_changes)
+    st.session_state.pop('activity_repo', None)
+    st.info(f"{len(remote_changes)} ändringar från andra användare har sammanfogats med dina.")
+
 # Konfigurera Gemini
 try:
     GOOGLE_API_KEY = st.secrets["GOOGLE_API_KEY"]
 except Exception:
     GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')  # Fallback för lokal utveckling
 
-if not GOOGLE_API_KEY:
+if not GOOGLE_API_KEY and ai.requires_api_key():
     st.error("❌ Ingen API-nyckel hittad. Kontakta administratören.")
     st.stop()
 
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel('gemini-pro')
+ai.configure(GOOGLE_API_KEY)
+ai.serve_metrics()
+
+# Panelen med AI-mätvärden visas bara med ?admin=<ISO_ADMIN_TOKEN> i URL:en
+ADMIN_TOKEN = os.getenv('ISO_ADMIN_TOKEN')
 
 def get_ai_analysis(data):
-    """Få AI-analys från Gemini"""
+    """Strömma AI-analys från Gemini i bitar (för st.write_stream)"""
     try:
         # Skapa en strukturerad prompt för analys
         prompt = f"""
@@ -112,10 +137,50 @@ def get_ai_analysis(data):
         Svara på svenska och var konkret i dina rekommendationer.
         """
         
-        response = model.generate_content(prompt)
-        return response.text
+        yield from ai.stream(prompt, label='analysis')
     except Exception as e:
-        return f"Kunde inte generera AI-analys: {str(e)}"
+        yield f"Kunde inte generera AI-analys: {ai.describe_error(e)}"
+
+# AI-jobb som den här sessionen har köat; bara de laddar om sidan medan de pågår
+if 'submitted_jobs' not in st.session_state:
+    st.session_state.submitted_jobs = set()
+
+# Egna pågående jobb som visas på den här sidan (fylls i av show_ai_result)
+polled_jobs = []
+
+def submit_ai_job(key, prompt, title):
+    job = ai_jobs.get_queue().submit(workspace, key, prompt, title=title)
+    st.session_state.submitted_jobs.add(job.id)
+
+def show_ai_result(slot, key, heading, failure):
+    """Visa AI-jobbet för key i slot: pågående svar, fel eller det sparade svaret
+
+    Jobben körs i bakgrunden (ai_jobs), så ett svar som genereras finns kvar
+    även om sidan laddas om eller byts under tiden.
+    """
+    job = ai_jobs.get_queue().latest(workspace, key)
+    saved = ai_jobs.saved_results(workspace).get(key)
+    with slot.container():
+        if job is not None and job.active:
+            own = job.id in st.session_state.submitted_jobs
+            if own:
+                polled_jobs.append(job)
+            st.markdown(heading)
+            status = "⏳ I kö..." if job.status == 'queued' else f"✍️ Genereras... ({job.seconds:.0f} s)"
+            st.caption(status if own else f"{status} Startat av en annan användare; ladda om sidan för att se svaret.")
+            if job.text:
+                st.markdown(job.text)
+            return
+        if job is not None:
+            st.session_state.submitted_jobs.discard(job.id)
+        if job is not None and job.status == 'failed':
+            st.error(f"{failure}: {ai.describe_error(job.error)}")
+        if saved is not None:
+            st.markdown(heading)
+            if saved.get('note'):
+                st.caption(saved['note'])
+            st.markdown(saved['text'])
+            st.caption(f"Genererad {saved['finished'].replace('T', ' ')}")
 
 # Sidopanel för navigation
 with st.sidebar:
@@ -125,94 +190,41 @@ with st.sidebar:
         ["Implementeringsguide", "Organisationsinformation", "Checklista", "Handlingsplan", "Exportera Data"]
     )
 
+    active_jobs = ai_jobs.get_queue().active(workspace)
+    if active_jobs:
+        st.caption(f"⏳ {len(active_jobs)} AI-jobb pågår i bakgrunden")
+    if ai.flights.saved:
+        st.caption(f"🔗 {ai.flights.saved} identiska AI-anrop har slagits ihop med pågående anrop")
+
+    if ADMIN_TOKEN and st.query_params.get('admin') == ADMIN_TOKEN:
+        with st.expander("📊 AI-mätvärden"):
+            rows = ai.metrics.rows()
+            if rows:
+                # Långsammast först; latens och tokens gäller egna anrop till modellen
+                st.dataframe(pd.DataFrame(rows).rename(columns={
+                    'label': "Anrop", 'model': "Modell", 'calls': "Antal", 'api': "Egna",
+                    'cache': "Cache", 'shared': "Delade", 'error': "Fel", 'cancelled': "Avbrutna",
+                    'p50': "p50 (s)", 'p95': "p95 (s)", 'ttft_p50': "Första bit p50 (s)",
+                    'prompt_tokens': "Tokens in", 'response_tokens': "Tokens ut", 'cost': "Kostnad (USD)",
+                }), hide_index=True)
+                st.caption(f"Sedan {datetime.fromtimestamp(ai.metrics.started):%Y-%m-%d %H:%M}. "
+                           f"Totalt ~{sum(row['cost'] for row in rows):.4f} USD.")
+            else:
+                st.caption("Inga AI-anrop ännu.")
+            st.download_button("Ladda ned (Prometheus)", ai.metrics_text(), file_name='ai_metrics.prom',
+                               mime='text/plain')
+
+    new_workspace = st.text_input("Arbetsyta", value=workspace)
+    if new_workspace and new_workspace != workspace:
+        st.query_params['workspace'] = new_workspace
+        st.rerun()
+
 # Implementeringsguide
 if page == "Implementeringsguide":
     st.header("🗺️ ISO 27001 Implementeringsguide")
     
-    # Definiera implementeringsstegen
-    implementation_steps = {
-        "1. Samla ditt team": {
-            "description": """
-            - Identifiera nyckelpersoner från olika avdelningar (IT, HR, juridik, kvalitet)
-            - Definiera roller och ansvar
-            - Skapa en RACI-matris
-            """,
-            "estimated_time": "1 vecka",
-            "deliverables": "Projekt RACI-matris, utkast till Statement of Applicability och Scope"
-        },
-        "2. Gap-analys": {
-            "description": """
-            - Utvärdera nuvarande säkerhetsstatus
-            - Identifiera gap mot ISO 27001-standarden
-            - Dokumentera resultat och rekommendationer
-            """,
-            "estimated_time": "2 veckor",
-            "deliverables": "Gap-analysrapport med identifierade risker och brister"
-        },
-        "3. Prioritera åtgärder": {
-            "description": """
-            - Analysera gap-analysens resultat
-            - Prioritera åtgärder baserat på risk och resurser
-            - Skapa handlingsplan
-            """,
-            "estimated_time": "6 veckor",
-            "deliverables": "Prioriterad åtgärdsplan med tidslinjer"
-        },
-        "4. Tillgångshantering": {
-            "description": """
-            - Identifiera informationstillgångar
-            - Klassificera tillgångar efter känslighet
-            - Upprätta tillgångsregister
-            """,
-            "estimated_time": "2 veckor",
-            "deliverables": "Uppdaterat tillgångsregister"
-        },
-        "5. Riskhantering": {
-            "description": """
-            - Genomför riskbedömning
-            - Identifiera och värdera hot
-            - Utveckla riskreducerande åtgärder
-            """,
-            "estimated_time": "2 veckor",
-            "deliverables": "Riskbedömning och åtgärdsplan"
-        },
-        "6. ISMS-dokumentation": {
-            "description": """
-            - Utveckla policyer och procedurer
-            - Skapa rutiner och arbetsinstruktioner
-            - Dokumentera säkerhetskontroller
-            """,
-            "estimated_time": "6 veckor",
-            "deliverables": "Komplett ISMS-dokumentation"
-        },
-        "7. Intern revision": {
-            "description": """
-            - Planera intern revision
-            - Genomför revision av ISMS
-            - Dokumentera resultat och avvikelser
-            """,
-            "estimated_time": "2 veckor",
-            "deliverables": "Intern revisionsrapport"
-        },
-        "8. Ledningens genomgång": {
-            "description": """
-            - Presentera resultat för ledningen
-            - Utvärdera ISMS effektivitet
-            - Besluta om förbättringsåtgärder
-            """,
-            "estimated_time": "2 veckor",
-            "deliverables": "Protokoll från ledningens genomgång"
-        },
-        "9. Extern revision och certifiering": {
-            "description": """
-            - Välj certifieringsorgan
-            - Genomgå steg 1-revision
-            - Genomgå steg 2-revision (platsbesök)
-            """,
-            "estimated_time": "2 veckor",
-            "deliverables": "ISO 27001-certifiering"
-        }
-    }
+    # Implementeringsstegen (se implementation_steps.py)
+    implementation_steps = IMPLEMENTATION_STEPS
     
     # Beräkna total progress
     if 'step_progress' not in st.session_state.iso_data:
@@ -225,6 +237,26 @@ if page == "Implementeringsguide":
     st.progress(completed_steps / total_steps)
     st.write(f"Total framsteg: {int((completed_steps / total_steps) * 100)}%")
     
+    # AI-rekommendationer för alla steg på en gång; jobben körs samtidigt i
+    # bakgrunden och varje svar visas i sitt steg så snart det är klart
+    # Jobben köas i knapparnas on_click, så att ett klick ger ett jobb även
+    # när sidan laddas om medan de körs
+    queue = ai_jobs.get_queue()
+
+    def submit_step(step, details):
+        submit_ai_job(f"step:{step.split('.')[0]}", step_prompt(step, details), step)
+
+    def submit_all_steps():
+        for step, details in implementation_steps.items():
+            submit_step(step, details)
+
+    st.button("🤖 Generera rekommendationer för alla steg", on_click=submit_all_steps)
+    step_jobs = [queue.latest(workspace, f"step:{step.split('.')[0]}") for step in implementation_steps]
+    running = sum(1 for job in step_jobs if job is not None and job.active)
+    if running:
+        done = len(implementation_steps) - running
+        st.progress(done / len(implementation_steps), text=f"{done} av {len(implementation_steps)} steg klara")
+    
     # Visa varje steg med detaljer
     for step, details in implementation_steps.items():
         with st.expander(f"{step} ({details['estimated_time']})"):
@@ -239,29 +271,76 @@ if page == "Implementeringsguide":
                 key=f"step_{step_key}",
                 value=st.session_state.iso_data['step_progress'].get(step_key, False)
             )
-            st.session_state.iso_data['step_progress'][step_key] = is_complete
+            if st.session_state.iso_data['step_progress'].get(step_key, False) != is_complete:
+                st.session_state.iso_data.set_fields(('step_progress',), {step_key: is_complete})
             
-            # Visa AI-rekommendationer för detta steg
-            if st.button(f"🤖 Få AI-rekommendationer för {step}", key=f"ai_{step_key}"):
-                with st.spinner("Analyserar och genererar rekommendationer..."):
-                    prompt = f"""
-                    Ge konkreta rekommendationer för följande steg i ISO 27001-implementationen:
-                    
-                    Steg: {step}
-                    Beskrivning: {details['description']}
-                    Förväntade leverabler: {details['deliverables']}
-                    
-                    Ge specifika, praktiska råd om:
-                    1. Hur man bäst genomför detta steg
-                    2. Vanliga fallgropar att undvika
-                    3. Viktiga framgångsfaktorer
-                    4. Konkreta exempel på best practices
-                    
-                    Svara på svenska och var mycket specifik.
-                    """
-                    response = model.generate_content(prompt)
-                    st.markdown("### AI-rekommendationer")
-                    st.markdown(response.text)
+            # Visa AI-rekommendationer för detta steg; svaret genereras i
+            # bakgrunden och sparas i planen, så det syns även efter omladdning
+            st.button(f"🤖 Få AI-rekommendationer för {step}", key=f"ai_{step_key}",
+                      on_click=submit_step, args=(step, details))
+            show_ai_result(st.empty(), f"step:{step_key}", "### AI-rekommendationer",
+                           "Kunde inte generera rekommendationer")
+    
+    # Tidsplan: kritiska linjen mot målsättningen för certifiering.
+    # Schemat sparas i sessionen och räknas om inkrementellt vid ändringar.
+    today = datetime.today().date()
+    target = st.session_state.iso_data.get('organisation_info', {}).get('target_date')
+    nodes = plan_nodes(implementation_steps, st.session_state.iso_data['step_progress'],
+                       st.session_state.iso_data.get('activities', []))
+    deadline = deadline_days(target, today)
+    try:
+        schedule = update_schedule(st.session_state.get('schedule'), nodes, deadline)
+    except CycleError as e:
+        # Ett felaktigt beroende ska inte hindra resten av sidan
+        schedule = None
+        names = {f"step:{step.split('.')[0]}": step for step in implementation_steps}
+        names.update({f"activity:{a['id']}": a.get('activity') or a['id']
+                      for a in st.session_state.iso_data.get('activities', [])})
+        st.error("Tidsplanen kan inte beräknas eftersom beroendena bildar en cykel: "
+                 f"{' → '.join(names.get(node_id, node_id) for node_id in e.nodes)}. "
+                 "Ändra beroendena under Handlingsplan.")
+    st.session_state.schedule = schedule
+    if schedule is not None:
+        with st.expander("📅 Tidsplan och kritisk linje"):
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Beräknat klart", (today + timedelta(days=schedule.project_days)).strftime('%Y-%m-%d'))
+            col2.metric("Målsättning", target or "Ej angivet")
+            if target:
+                col3.metric("Marginal", f"{schedule.min_slack():.0f} dagar")
+                if schedule.min_slack() < 0:
+                    st.warning("Planen når inte målsättningen för certifiering med nuvarande tidsuppskattningar.")
+        
+            critical = set(schedule.critical_path())
+            rows = []
+            for step in implementation_steps:
+                node_id = f"step:{step.split('.')[0]}"
+                result = schedule.result(node_id)
+                rows.append({
+                    "Steg": step,
+                    "Tidigast start": (today + timedelta(days=result['es'])).strftime('%Y-%m-%d'),
+                    "Senast start": (today + timedelta(days=result['ls'])).strftime('%Y-%m-%d'),
+                    "Marginal (dagar)": round(result['slack']),
+                    "Kritisk": node_id in critical,
+                })
+            st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+            critical_activities = sum(1 for node_id in critical if node_id.startswith('activity:'))
+            if critical_activities:
+                st.write(f"{critical_activities} aktiviteter ligger på den kritiska linjen.")
+        
+            # Prognos: simulerad återstående tid (cachad tills framsteg eller datum ändras)
+            prognosis = forecast(nodes, deadline)
+            st.subheader("Prognos")
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Klart (P50)", (today + timedelta(days=prognosis['p50'])).strftime('%Y-%m-%d'))
+            col2.metric("Klart (P90)", (today + timedelta(days=prognosis['p90'])).strftime('%Y-%m-%d'))
+            if prognosis['probability'] is not None:
+                col3.metric("Sannolikhet att nå målet", f"{prognosis['probability']:.0%}")
+            st.caption(f"Baserat på {prognosis['simulations']:,} simuleringar där varje återstående steg "
+                       f"och aktivitet tar {LOW_FACTOR:.0%}–{HIGH_FACTOR:.0%} av uppskattad tid.")
+            if prognosis['simulations'] < prognosis['requested']:
+                st.caption(f"Planen är stor, så antalet simuleringar har begränsats från "
+                           f"{prognosis['requested']:,} för att hålla nere beräkningstiden "
+                           f"(ISO_FORECAST_DRAWS).")
     
     # Spara-knapp för framsteg
     if st.button("💾 Spara framsteg"):
@@ -285,7 +364,7 @@ elif page == "Organisationsinformation":
         target_date = st.date_input("Målsättning för certifiering", 
                                   value=datetime.strptime(st.session_state.iso_data['organisation_info'].get('target_date', datetime.today().strftime('%Y-%m-%d')), '%Y-%m-%d'))
     
-    st.session_state.iso_data['organisation_info'].update({
+    st.session_state.iso_data.set_fields(('organisation_info',), {
         'org_name': org_name,
         'org_size': org_size,
         'contact_person': contact_person,
@@ -316,11 +395,11 @@ elif page == "Checklista":
     
     if engagement_values != st.session_state.iso_data['checklists']['ledningens_engagemang']:
         changed = True
-        st.session_state.iso_data['checklists']['ledningens_engagemang'] = engagement_values
+        st.session_state.iso_data.edit('checklists')['ledningens_engagemang'] = engagement_values
 
     # Omfattning (Scope)
     st.subheader("2. Omfattning (Scope)")
-    st.session_state.iso_data['checklists']['scope'].update({
+    st.session_state.iso_data.set_fields(('checklists', 'scope'), {
         'scope_definierat': st.checkbox("Omfattningen av ISMS är definierad", 
                                       st.session_state.iso_data['checklists']['scope'].get('scope_definierat', False)),
         'granser_dokumenterade': st.checkbox("Organisatoriska gränser är dokumenterade", 
@@ -331,7 +410,7 @@ elif page == "Checklista":
     
     # Riskanalys
     st.subheader("3. Riskanalys")
-    st.session_state.iso_data['checklists']['riskanalys'].update({
+    st.session_state.iso_data.set_fields(('checklists', 'riskanalys'), {
         'metodik_vald': st.checkbox("Riskanalysmetodik är vald", 
                                   st.session_state.iso_data['checklists']['riskanalys'].get('metodik_vald', False)),
         'tillgangar_identifierade': st.checkbox("Informationstillgångar är identifierade", 
@@ -349,45 +428,32 @@ elif page == "Checklista":
 # Handlingsplan
 elif page == "Handlingsplan":
     st.header("📝 Handlingsplan")
+
+    # Aktiviteterna med index för filtrering och sortering, byggs en gång per session.
+    # Listan delas med andra sessioner tills den ändras första gången.
+    activities = st.session_state.iso_data.get('activities', [])
+    if st.session_state.get('activity_repo') is None or st.session_state.activity_repo.activities is not activities:
+        st.session_state.activity_repo = ActivityRepository(
+            activities, own=partial(st.session_state.iso_data.edit, 'activities', []))
+    repo = st.session_state.activity_repo
     
-    # AI-analys av handlingsplan
-    if st.button("🤖 Få AI-analys av handlingsplan"):
-        with st.spinner("Analyserar handlingsplan och genererar rekommendationer..."):
-            activities = st.session_state.iso_data.get('activities', [])
-            org_info = st.session_state.iso_data.get('organisation_info', {})
-            checklists = st.session_state.iso_data.get('checklists', {})
-            
-            prompt = f"""
-            Analysera följande handlingsplan för ISO 27001-implementering och ge konkreta rekommendationer:
-
-            Organisationsinformation:
-            - Namn: {org_info.get('org_name', 'Ej angivet')}
-            - Antal anställda: {org_info.get('org_size', 'Ej angivet')}
-            - Målsättning för certifiering: {org_info.get('target_date', 'Ej angivet')}
-
-            Nuvarande aktiviteter i handlingsplanen:
-            {chr(10).join([f"- {a['activity']} (Prioritet: {a['priority']}, Status: {a['status']}, Deadline: {a['due_date']})" for a in activities])}
-
-            Checklista status:
-            Ledningens engagemang: {', '.join([k for k, v in checklists.get('ledningens_engagemang', {}).items() if v])}
-            Scope: {', '.join([k for k, v in checklists.get('scope', {}).items() if v])}
-            Riskanalys: {', '.join([k for k, v in checklists.get('riskanalys', {}).items() if v])}
-
-            Baserat på denna information, ge rekommendationer om:
-            1. Saknade kritiska aktiviteter som bör läggas till
-            2. Förslag på omprioritering av befintliga aktiviteter
-            3. Tidslinjejusteringar baserat på best practices
-            4. Specifika åtgärder för att öka effektiviteten
-            5. Risker att vara uppmärksam på
-
-            Svara på svenska och var mycket specifik i dina rekommendationer.
-            Om det saknas aktiviteter, ge konkreta exempel på aktiviteter som bör läggas till.
-            """
-            
-            response = model.generate_content(prompt)
-            st.markdown("### 🤖 AI-analys och rekommendationer")
-            st.markdown(response.text)
-            st.markdown("---")
+    # AI-analys av handlingsplan; körs i bakgrunden på en kopia av planen
+    def submit_plan_analysis():
+        plan = snapshot(st.session_state.iso_data)
+
+        def plan_analysis():
+            # Stora planer sammanfattas i delar först så att prompten håller sig inom budget
+            prompt, prompt_info = build_plan_analysis_prompt(plan)
+            note = None
+            if prompt_info['chunks']:
+                note = (f"{prompt_info['activities']} aktiviteter sammanfattades i "
+                        f"{prompt_info['chunks']} delar före analysen.")
+            return prompt, note
+
+        submit_ai_job('plan', plan_analysis, "Handlingsplan")
+
+    st.button("🤖 Få AI-analys av handlingsplan", on_click=submit_plan_analysis)
+    show_ai_result(st.empty(), 'plan', "### 🤖 AI-analys och rekommendationer", "Kunde inte generera AI-analys")
     
     # Lägg till ny aktivitet
     st.subheader("Lägg till aktivitet")
@@ -395,43 +461,109 @@ elif page == "Handlingsplan":
     
     with col1:
         new_activity = st.text_input("Aktivitet")
-        priority = st.selectbox("Prioritet", ["Hög", "Medium", "Låg"])
+        priority = st.selectbox("Prioritet", PRIORITIES)
     
     with col2:
         due_date = st.date_input("Deadline")
         responsible = st.text_input("Ansvarig")
     
     if st.button("Lägg till aktivitet"):
-        if 'activities' not in st.session_state.iso_data:
-            st.session_state.iso_data['activities'] = []
-        
-        st.session_state.iso_data['activities'].append({
+        repo.add({
+            'id': new_activity_id(),
             'activity': new_activity,
             'priority': priority,
             'due_date': due_date.strftime('%Y-%m-%d'),
             'responsible': responsible,
             'status': 'Ej påbörjad'
         })
+
+    # Massimport: alla rader valideras tillsammans och läggs till i en sparning
+    with st.expander("📥 Importera aktiviteter från CSV eller Excel"):
+        st.markdown("Kolumner: Aktivitet, Prioritet, Deadline (ÅÅÅÅ-MM-DD), Ansvarig och valfritt Status.")
+        import_file = st.file_uploader("Importfil", type=['csv', 'xlsx'])
+        if import_file and st.button("Importera"):
+            imported, import_errors, rate = import_activities(import_file, import_file.name)
+            if not import_errors.empty:
+                st.error(f"{len(import_errors)} fel hittades – inget importerades.")
+                st.dataframe(import_errors, hide_index=True)
+            else:
+                repo.extend(imported)
+                save_data_to_file()
+                st.success(f"Importerade {len(imported)} aktiviteter ({rate:,.0f} rader/s).")
     
-    # Visa aktiviteter
-    if 'activities' in st.session_state.iso_data and st.session_state.iso_data['activities']:
+    # Visa aktiviteter som en sidindelad tabell; bara aktuell sida skickas till webbläsaren
+    if len(repo):
         st.subheader("Aktiviteter")
-        for idx, activity in enumerate(st.session_state.iso_data['activities']):
-            col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
-            with col1:
-                st.write(f"**{activity['activity']}**")
-            with col2:
-                st.write(f"Prioritet: {activity['priority']}")
-            with col3:
-                st.write(f"Deadline: {activity['due_date']}")
-            with col4:
-                status = st.selectbox(
-                    "Status",
-                    ["Ej påbörjad", "Pågående", "Klar"],
-                    key=f"status_{idx}",
-                    index=["Ej påbörjad", "Pågående", "Klar"].index(activity['status'])
-                )
-                activity['status'] = status
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            status_filter = st.multiselect("Status", STATUSES)
+        with col2:
+            priority_filter = st.multiselect("Prioritet", PRIORITIES, key="priority_filter")
+        with col3:
+            responsible_filter = st.multiselect("Ansvarig", repo.values('responsible'))
+        with col4:
+            only_overdue = st.checkbox("Endast försenade")
+
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            sort_field = st.selectbox("Sortera på", list(SORT_FIELDS), format_func=lambda f: SORT_FIELDS[f])
+        with col2:
+            page_size = st.selectbox("Rader per sida", [25, 50, 100, 250])
+        with col4:
+            descending = st.checkbox("Fallande ordning")
+
+        query = dict(
+            priority=priority_filter or None,
+            responsible=responsible_filter or None,
+            sort_by=sort_field,
+            order=SORT_ORDER.get(sort_field),
+            descending=descending
+        )
+        if only_overdue:
+            matches = repo.overdue(datetime.today().date(), **query)
+            if status_filter:
+                matches = [a for a in matches if a['status'] in status_filter]
+        else:
+            matches = repo.query(status=status_filter or None, **query)
+
+        page_count = max(1, -(-len(matches) // page_size))
+        with col3:
+            page_number = st.number_input("Sida", min_value=1, max_value=page_count, value=1)
+        page_activities = matches[(page_number - 1) * page_size:page_number * page_size]
+        st.caption(f"Visar {len(page_activities)} av {len(matches)} aktiviteter (sida {page_number} av {page_count})")
+
+        if 'grid_version' not in st.session_state:
+            st.session_state.grid_version = 0
+        grid_key = f"activity_grid_{st.session_state.grid_version}"
+        st.data_editor(
+            pd.DataFrame(page_activities, columns=GRID_COLUMNS),
+            key=grid_key,
+            hide_index=True,
+            use_container_width=True,
+            column_order=GRID_COLUMNS[1:],
+            disabled=['activity', 'due_date'],
+            column_config={
+                'activity': st.column_config.TextColumn("Aktivitet", width="large"),
+                'priority': st.column_config.SelectboxColumn("Prioritet", options=PRIORITIES, required=True),
+                'due_date': st.column_config.TextColumn("Deadline"),
+                'responsible': st.column_config.TextColumn("Ansvarig"),
+                'status': st.column_config.SelectboxColumn("Status", options=STATUSES, required=True),
+            }
+        )
+
+        # Skriv bara tillbaka de rader som ändrats i tabellen
+        changed = False
+        for row, changes in st.session_state[grid_key]['edited_rows'].items():
+            activity = page_activities[int(row)]
+            changes = {f: v for f, v in changes.items() if activity.get(f) != v}
+            if changes:
+                repo.update(activity['id'], **changes)
+                changed = True
+        if changed:
+            save_data_to_file()
+            # Ny nyckel så att radindex inte blandas ihop när sorteringen ändras
+            st.session_state.grid_version += 1
+            st.rerun()
 
     # Spara-knapp för handlingsplan
     if st.button("💾 Spara handlingsplan"):
@@ -442,20 +574,37 @@ elif page == "Handlingsplan":
 elif page == "Exportera Data":
     st.header("💾 Exportera Data")
     
-    if st.button("Ladda ner ISO 27001-plan"):
-        # Konvertera data till JSON
-        json_data = json.dumps(st.session_state.iso_data, indent=2, ensure_ascii=False)
-        
-        # Skapa nedladdningsbar länk
+    export_format = st.selectbox("Format", list(EXPORT_FORMATS), format_func=lambda f: EXPORT_FORMATS[f][0])
+    _, _, extension, mime = EXPORT_FORMATS[export_format]
+
+    # Exporten skrivs bit för bit till en temporärfil i stället för att byggas
+    # upp i minnet, och hålls inte kvar i sessionen efter att sidan visats
+    with tempfile.TemporaryFile() as export_file:
+        write_export(st.session_state.iso_data, export_format, export_file)
         st.download_button(
-            label="Klicka här för att ladda ner",
-            data=json_data,
-            file_name=f"iso27001_plan_{datetime.now().strftime('%Y%m%d')}.json",
-            mime="application/json"
+            label="Ladda ner ISO 27001-plan",
+            # download_button läser filobjekt av typen RawIOBase, inte BufferedRandom
+            data=export_file.raw,
+            file_name=f"iso27001_plan_{datetime.now().strftime('%Y%m%d')}.{extension}",
+            mime=mime
         )
-        
-        st.success("Din ISO 27001-plan är redo för nedladdning!")
+
+    # Ändringshistorik finns när planen lagras som logg (ISO_STORAGE=journal)
+    if hasattr(st.session_state.storage, 'history'):
+        with st.expander("🕓 Ändringshistorik"):
+            for entry in st.session_state.storage.history():
+                when = datetime.fromtimestamp(entry['t']).strftime('%Y-%m-%d %H:%M:%S')
+                path = ' › '.join(str(p) for p in entry['p'])
+                change = "borttagen" if entry.get('d') else json.dumps(entry['v'], ensure_ascii=False)
+                st.text(f"{when}  {path}: {change}")
 
 # Footer
 st.markdown("---")
 st.markdown("*Detta är ett verktyg för att hjälpa till med planering av ISO 27001-certifiering. Det ersätter inte professionell rådgivning.*")
+
+# Ladda om sidan medan AI-jobb som den här sessionen köat och som visas på
+# sidan pågår, så att svaren visas allteftersom de kommer; ett klick eller
+# sidbyte avbryter väntan direkt. Andra sessioner i arbetsytan påverkas inte.
+if polled_jobs:
+    time.sleep(ai_jobs.POLL_INTERVAL)
+    st.rerun()